@@ -0,0 +1,41 @@
+"""Tools the research agent calls. They take the agent's RunContext, so this module imports
+pydantic_ai and is only imported when the research agent is built."""
+from typing import Dict, List
+from pydantic_ai import RunContext
+from .models import Deps
+from .tools import search_once
+from .tracing import span
+import asyncio
+
+# Maximum number of queries run by one search_google_batch call
+MAX_BATCH_QUERIES = 6
+
+async def search_google(ctx: RunContext[Deps], query: str, max_results: int = 1) -> List[str]:
+    """Search Google for the given query and return the results as a list of strings.
+    
+    Args:
+        ctx: The run context containing dependencies
+        query: The query to search for
+        max_results: The maximum number of results to return
+        
+    Returns:
+        A list of strings containing the search results
+    """
+    return await search_once(ctx.deps, query, max_results)
+
+async def search_google_batch(ctx: RunContext[Deps], queries: List[str], max_results: int = 1) -> Dict[str, List[str]]:
+    """Search Google for several queries at once and return the results grouped by query.
+    
+    Args:
+        ctx: The run context containing dependencies
+        queries: The queries to search for, e.g. one per topic such as funding, leadership, competitors and news
+        max_results: The maximum number of results to return per query
+        
+    Returns:
+        A dictionary mapping each query to a list of strings containing its search results
+    """
+    # Drop duplicates while keeping the order of the queries
+    queries = list(dict.fromkeys(query for query in queries if query.strip()))[:MAX_BATCH_QUERIES]
+    with span("tool.search_google_batch", queries=len(queries)):
+        results = await asyncio.gather(*[search_once(ctx.deps, query, max_results) for query in queries])
+    return dict(zip(queries, results))
@@ -0,0 +1,251 @@
+from apify import Actor
+from apify_client import ApifyClientAsync
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import math
+from .cache import canonical_domain, canonical_linkedin_url, canonical_query
+from .profiles import ResourceProfiles
+
+if TYPE_CHECKING:
+    from .models import Deps
+
+def route_linkedin_items(items: List[Dict[str, Any]], targets: Dict[str, str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Split LinkedIn scraper items into one `{"data": [entry]}` item per requested company URL."""
+    routed: Dict[str, List[Dict[str, Any]]] = {}
+    for item in items:
+        for entry in item.get("data", []) if isinstance(item, dict) else []:
+            if not isinstance(entry, dict):
+                continue
+            result = entry.get("result") or {}
+            url = entry.get("url") or entry.get("linkedinUrl") or entry.get("input") or result.get("url") or result.get("linkedinUrl") or ""
+            key = canonical_linkedin_url(str(url))
+            if key in targets:
+                routed.setdefault(key, []).append({**item, "data": [entry]})
+    return routed
+
+def route_items_by_field(fields: List[str], canonicalize: Callable[[str], str]) -> Callable:
+    """Build a router that matches items to targets by the first field in `fields` that matches a target."""
+    def route(items: List[Dict[str, Any]], targets: Dict[str, str]) -> Dict[str, List[Dict[str, Any]]]:
+        routed: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            for field in fields:
+                # A field may hold another URL, e.g. the Similarweb page of the site, so try the next one
+                key = canonicalize(str(item[field])) if item.get(field) else None
+                if key in targets:
+                    routed.setdefault(key, []).append(item)
+                    break
+        return routed
+    return route
+
+# Run statuses after which an actor run no longer changes
+FINISHED_RUN_STATUSES = {"SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"}
+
+async def abort_run(client: ApifyClientAsync, run_id: str, actor_id: str) -> None:
+    """Abort a run that exceeded its time budget; its dataset keeps the items pushed so far."""
+    Actor.log.warning(f"Aborting run {run_id} of {actor_id} that ran out of time")
+    try:
+        await client.run(run_id).abort()
+    except Exception as e:
+        Actor.log.warning(f"Failed to abort run {run_id} of {actor_id}: {str(e)}")
+
+# How to canonicalize targets and route dataset items back to them, per batchable source
+BATCH_ROUTES = {
+    "linkedin": (canonical_linkedin_url, route_linkedin_items),
+    "similarweb": (canonical_domain, route_items_by_field(["url", "name"], canonical_domain)),
+    "google_maps": (canonical_query, route_items_by_field(["searchString"], canonical_query)),
+}
+
+class BatchDispatcher:
+    """Coalesces targets submitted within a short window into a single multi-target actor run.
+
+    Each batch runs with the smallest time budget left among its callers, and is aborted when every
+    caller waiting for it was cancelled.
+    """
+
+    def __init__(
+        self,
+        client: ApifyClientAsync,
+        source: str,
+        actor_id: str,
+        input_key: str,
+        base_input: Dict[str, Any],
+        memory_mbytes: int,
+        window_secs: float,
+        max_batch_size: int,
+        profiles: Optional[ResourceProfiles] = None,
+    ):
+        self.client = client
+        self.source = source
+        self.actor_id = actor_id
+        self.input_key = input_key
+        self.base_input = base_input
+        self.memory_mbytes = memory_mbytes
+        self.window_secs = window_secs
+        self.max_batch_size = max_batch_size
+        self.profiles = profiles
+        self.canonicalize, self.route = BATCH_ROUTES[source]
+        self.runs = 0
+        self.targets = 0
+        # Futures of the callers waiting for each target, with the deps of their company
+        self._pending: Dict[str, List[Tuple[asyncio.Future, "Deps"]]] = {}
+        self._raw_targets: Dict[str, str] = {}
+        self._timer: Optional[asyncio.Task] = None
+        self._batches: Dict[asyncio.Task, Dict[str, List[Tuple[asyncio.Future, "Deps"]]]] = {}
+
+    async def submit(self, target: str, deps: "Deps") -> Optional[List[Dict[str, Any]]]:
+        """Queue a target for the next batch and wait for its dataset items.
+
+        `deps` are the caller's Deps: their time budget caps the batch, and their `timed_out_sources`
+        records the source when the batch is stopped before it finishes. Returns None when a finished
+        batch has no items routed to the target, so that the caller can run it on its own.
+        """
+        key = self.canonicalize(target)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((future, deps))
+        self._raw_targets.setdefault(key, target)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self._forget(key, future)
+            raise
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        """Drop a cancelled caller, and abort its batch once nobody waits for it anymore."""
+        waiters = self._pending.get(key, [])
+        if any(waiter is future for waiter, _ in waiters):
+            waiters = [(waiter, deps) for waiter, deps in waiters if waiter is not future]
+            if waiters:
+                self._pending[key] = waiters
+            else:
+                del self._pending[key]
+                del self._raw_targets[key]
+            return
+        for task, batch in self._batches.items():
+            if any(waiter is future for waiter, _ in batch.get(key, [])):
+                if all(waiter.done() for waiters in batch.values() for waiter, _ in waiters):
+                    task.cancel()
+                return
+
+    async def _flush_after_window(self) -> None:
+        await asyncio.sleep(self.window_secs)
+        self._timer = None
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        raw_targets, self._raw_targets = self._raw_targets, {}
+        task = asyncio.create_task(self._run_batch(pending, raw_targets))
+        self._batches[task] = pending
+        task.add_done_callback(lambda task: self._batches.pop(task, None))
+
+    async def _run_batch(self, pending: Dict[str, List[Tuple[asyncio.Future, "Deps"]]], raw_targets: Dict[str, str]) -> None:
+        # Imported here, the tools import this module
+        from .tools import iterate_dataset_pages
+
+        waiters = [waiter for key_waiters in pending.values() for waiter in key_waiters]
+        budgets = [budget for budget in (deps.time_budget(self.source) for _, deps in waiters) if budget is not None]
+        timeout_secs = max(1, math.ceil(min(budgets))) if budgets else None
+        self.runs += 1
+        self.targets += len(pending)
+        Actor.log.info(f"Running {self.actor_id} for a batch of {len(pending)} targets")
+        try:
+            run_input = {**self.base_input, self.input_key: list(raw_targets.values())}
+            memory_mbytes = self.profiles.choose(self.actor_id, run_input, self.memory_mbytes) if self.profiles else self.memory_mbytes
+            run = await self.client.actor(self.actor_id).start(run_input=run_input, memory_mbytes=memory_mbytes, timeout_secs=timeout_secs)
+            try:
+                finished = await self.client.run(run["id"]).wait_for_finish(wait_secs=timeout_secs)
+            except asyncio.CancelledError:
+                # Every caller gave up on this batch, stop the run instead of letting it finish unobserved
+                await asyncio.shield(abort_run(self.client, run["id"], self.actor_id))
+                raise
+            if self.profiles:
+                self.profiles.record(self.actor_id, run_input, memory_mbytes, finished)
+            # Route whatever the run produced before it was stopped
+            status = (finished or {}).get("status")
+            if status not in FINISHED_RUN_STATUSES:
+                await abort_run(self.client, run["id"], self.actor_id)
+            timed_out = status not in FINISHED_RUN_STATUSES or status == "TIMED-OUT"
+            if timed_out:
+                Actor.log.warning(f"{self.actor_id} ran out of time, using the partial results of its batch")
+                for _, deps in waiters:
+                    deps.timed_out_sources.add(self.source)
+            # Read the dataset a page at a time like a direct run, a large batch can have many items
+            items = [item async for page in iterate_dataset_pages(waiters[0][1], run["defaultDatasetId"]) for item in page]
+            # A batch of one keeps every item, exactly like a direct run
+            routed = {next(iter(pending)): items} if len(pending) == 1 else self.route(items, raw_targets)
+        except Exception as e:
+            for future, _ in waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, key_waiters in pending.items():
+            items = routed.get(key, [])
+            # A target of a finished batch without items may just not be recognized by the router
+            if not items and len(pending) > 1 and not timed_out:
+                Actor.log.warning(f"No items of the {self.actor_id} batch matched {raw_targets[key]}, running it on its own")
+                items = None
+            for future, _ in key_waiters:
+                if not future.done():
+                    future.set_result(items)
+
+class ScraperBatcher:
+    """Holds one BatchDispatcher per scraper source and run input."""
+
+    def __init__(
+        self,
+        client: ApifyClientAsync,
+        window_secs: float = 2.0,
+        max_batch_size: int = 10,
+        profiles: Optional[ResourceProfiles] = None,
+    ):
+        self.client = client
+        self.window_secs = window_secs
+        self.max_batch_size = max_batch_size
+        self.profiles = profiles
+        self.dispatchers: Dict[Tuple[str, str], BatchDispatcher] = {}
+
+    async def submit(
+        self,
+        source: str,
+        target: str,
+        actor_id: str,
+        input_key: str,
+        base_input: Dict[str, Any],
+        memory_mbytes: int,
+        deps: "Deps",
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Submit a target to the dispatcher of its source and input, creating the dispatcher on first use.
+
+        Only targets with the same actor, input and memory share a run.
+        """
+        key = (source, json.dumps([actor_id, input_key, base_input, memory_mbytes], sort_keys=True))
+        if key not in self.dispatchers:
+            self.dispatchers[key] = BatchDispatcher(
+                self.client, source, actor_id, input_key, base_input, memory_mbytes,
+                self.window_secs, self.max_batch_size, self.profiles,
+            )
+        return await self.dispatchers[key].submit(target, deps)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats: Dict[str, Dict[str, int]] = {}
+        for (source, _), dispatcher in self.dispatchers.items():
+            source_stats = stats.setdefault(source, {"runs": 0, "targets": 0})
+            source_stats["runs"] += dispatcher.runs
+            source_stats["targets"] += dispatcher.targets
+        return stats
@@ -0,0 +1,614 @@
+"""Offline load test of the research pipeline.
+
+Drives `research_companies()` across synthetic companies with a fake Apify client and scripted
+LLMs for both agents, so throughput and concurrency can be measured without any API calls.
+
+Run with: python -m src.benchmark --companies 20 --concurrency 5 --latency 0.5
+
+`--startup` instead measures the cold start: the import time of `src.main` and the time until the
+Actor logs its first line, each in fresh interpreters.
+"""
+from apify import Actor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from unittest.mock import patch
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from . import main
+from .billing import BILLING_SUMMARY_KEY
+from .mapping import TRUSTPILOT_MAPPING
+from .models import BasicCompanyInfo, TrustpilotReview
+from .speculation import compact_name
+
+@dataclass
+class FakeActor:
+    """Canned behaviour of one actor: its dataset items for a run input, run latency and failure rate.
+
+    `latency` is the run time at 1024 MB; at other memory sizes it scales by
+    `(1024 / memory) ** memory_elasticity`. Runs with less than `min_memory_mbytes` fail.
+    """
+    items: Callable[[Dict[str, Any]], List[Dict[str, Any]]]
+    latency: float = 0.5
+    failure_rate: float = 0.0
+    memory_elasticity: float = 0.0
+    min_memory_mbytes: int = 128
+
+    def latency_at(self, memory_mbytes: int) -> float:
+        return self.latency * (1024 / memory_mbytes) ** self.memory_elasticity
+
+class FakeApifyClient:
+    """Stand-in for ApifyClientAsync serving actors from a registry keyed by actor ID."""
+
+    def __init__(self, registry: Dict[str, FakeActor], seed: int = 0):
+        self.registry = registry
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.failures: Counter = Counter()
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self.aborted: List[str] = []
+        self.list_requests: List[Tuple[str, int, Optional[int]]] = []
+        self._ids = itertools.count(1)
+
+    def actor(self, actor_id: str) -> "FakeActorClient":
+        return FakeActorClient(self, actor_id)
+
+    def run(self, run_id: str) -> "FakeRunClient":
+        return FakeRunClient(self, run_id)
+
+    def dataset(self, dataset_id: str) -> "FakeDatasetClient":
+        return FakeDatasetClient(self, dataset_id)
+
+class FakeActorClient:
+    def __init__(self, client: FakeApifyClient, actor_id: str):
+        self.client = client
+        self.actor_id = actor_id
+
+    async def start(
+        self, run_input: Any = None, memory_mbytes: Optional[int] = None, timeout_secs: Optional[int] = None, **kwargs,
+    ) -> Dict[str, Any]:
+        try:
+            actor = self.client.registry[self.actor_id]
+        except KeyError:
+            raise ValueError(f"No fake registered for actor {self.actor_id}") from None
+        self.client.calls[self.actor_id] += 1
+        if self.client.random.random() < actor.failure_rate:
+            self.client.failures[self.actor_id] += 1
+            raise RuntimeError(f"Simulated failure of actor {self.actor_id}")
+
+        # A run over its timeout stops early with the first half of its items
+        memory_mbytes = memory_mbytes or 1024
+        latency = actor.latency_at(memory_mbytes)
+        timed_out = timeout_secs is not None and latency > timeout_secs
+        out_of_memory = memory_mbytes < actor.min_memory_mbytes
+        items = [] if out_of_memory else actor.items(run_input or {})
+        run_id = f"run-{next(self.client._ids)}"
+        self.client.runs[run_id] = {
+            "items": items[:len(items) // 2] if timed_out else items,
+            "actor_id": self.actor_id,
+            "memory_mbytes": memory_mbytes,
+            "started_at": time.perf_counter(),
+            "finishes_at": time.perf_counter() + (timeout_secs if timed_out else latency),
+            "status": "FAILED" if out_of_memory else "TIMED-OUT" if timed_out else "SUCCEEDED",
+        }
+        return {"id": run_id, "defaultDatasetId": run_id, "status": "RUNNING"}
+
+    async def call(self, run_input: Any = None, wait_secs: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+        run = await self.start(run_input=run_input, **kwargs)
+        return await self.client.run(run["id"]).wait_for_finish(wait_secs=wait_secs)
+
+class FakeRunClient:
+    def __init__(self, client: FakeApifyClient, run_id: str):
+        self.client = client
+        self.run_id = run_id
+
+    async def wait_for_finish(self, wait_secs: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+        run = self.client.runs[self.run_id]
+        remaining = max(0.0, run["finishes_at"] - time.perf_counter())
+        await asyncio.sleep(remaining if wait_secs is None else min(remaining, wait_secs))
+        finished = time.perf_counter() >= run["finishes_at"]
+        run_time = round(min(time.perf_counter(), run["finishes_at"]) - run["started_at"], 3)
+        return {
+            "id": self.run_id,
+            "defaultDatasetId": self.run_id,
+            "status": run["status"] if finished else "RUNNING",
+            "options": {"memoryMbytes": run["memory_mbytes"]},
+            # One compute unit is 1 GB of memory for one hour
+            "stats": {"runTimeSecs": run_time, "computeUnits": run["memory_mbytes"] / 1024 * run_time / 3600},
+        }
+
+    async def abort(self, **kwargs) -> Dict[str, Any]:
+        run = self.client.runs[self.run_id]
+        self.client.aborted.append(self.run_id)
+        run["status"] = "ABORTED"
+        run["finishes_at"] = min(run["finishes_at"], time.perf_counter())
+        return {"id": self.run_id, "status": "ABORTED"}
+
+class FakeDatasetClient:
+    def __init__(self, client: FakeApifyClient, dataset_id: str):
+        self.client = client
+        self.dataset_id = dataset_id
+
+    async def list_items(self, offset: int = 0, limit: Optional[int] = None, **kwargs) -> SimpleNamespace:
+        run = self.client.runs[self.dataset_id]
+        self.client.list_requests.append((run["actor_id"], offset, limit))
+        items = run["items"]
+        return SimpleNamespace(items=items[offset:offset + limit if limit is not None else None])
+
+    async def iterate_items(self, offset: int = 0, limit: Optional[int] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        for item in (await self.list_items(offset=offset, limit=limit)).items:
+            yield item
+
+def company_domain(company_name: str) -> str:
+    return f"{compact_name(company_name)}.com"
+
+def fake_search_items(run_input: Dict[str, Any]) -> List[Dict[str, Any]]:
+    query = run_input.get("query", "")
+    paragraphs = [
+        f"{query} is a software company founded in 2015 that helps developers automate the web.",
+        "The company raised a $20 million Series A round from leading investors.",
+        "Its platform offers products for web scraping, data extraction and automation, sold as subscription plans.",
+        "Competitors include several data extraction platforms and in-house tooling.",
+    ] * 5
+    return [
+        {
+            "searchResult": {"title": f"{query} - result {i + 1}", "url": f"https://example.com/{i + 1}"},
+            "markdown": "\n\n".join(paragraphs),
+        }
+        for i in range(run_input.get("maxResults", 1))
+    ]
+
+def fake_linkedin_items(run_input: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"data": [
+        {
+            "url": url,
+            "result": {
+                "name": url.rstrip("/").rsplit("/", 1)[-1],
+                "description": "A software company.",
+                "industry": "Software Development",
+                "numberOfEmployees": 120,
+                "specialties": [{"value": "Web Scraping"}, {"value": "Automation"}],
+                "address": {"streetAddress": "1 Main Street", "addressLocality": "Prague", "addressCountry": "CZ"},
+            },
+        }
+        for url in run_input.get("linkedinUrls", [])
+    ]}]
+
+def fake_trustpilot_items(run_input: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "reviewUrl": f"https://www.trustpilot.com/reviews/{run_input.get('companyDomain')}-{i}",
+            "authorName": f"Reviewer {i}",
+            "reviewHeadline": "Solid product",
+            "reviewBody": "Works well for our data extraction needs. Support was quick to respond.",
+            "ratingValue": 1 + i % 5,
+        }
+        for i in range(min(run_input.get("count", 100), 20))
+    ]
+
+def fake_similarweb_items(run_input: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "url": website,
+            "name": website,
+            "globalRank": 25000,
+            "categoryId": "computers_electronics_and_technology/programming_and_developer_software",
+            "companyYearFounded": 2015,
+            "totalVisits": 1500000,
+            "bounceRate": 0.45,
+            "companyHeadquarterCity": "Prague",
+            "companyHeadquarterCountryCode": "CZ",
+            "topCountries": [{"countryAlpha2Code": "US", "visitsShare": 0.3}],
+        }
+        for website in run_input.get("websites", [])
+    ]
+
+def fake_google_maps_items(run_input: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "searchString": query,
+            "title": query,
+            "address": query,
+            "totalScore": 4.6,
+            "reviewsCount": 10,
+            "reviews": [{"name": f"Visitor {i}", "text": "Friendly team.", "stars": 5} for i in range(10)],
+        }
+        for query in run_input.get("searchStringsArray", [])
+    ]
+
+def default_registry(latency: float = 0.5, failure_rate: float = 0.0) -> Dict[str, FakeActor]:
+    """Fakes for every actor the pipeline calls, all with the same latency and failure rate."""
+    return {
+        "apify/rag-web-browser": FakeActor(fake_search_items, latency, failure_rate),
+        "icypeas_official/linkedin-company-scraper": FakeActor(fake_linkedin_items, latency, failure_rate),
+        "nikita-sviridenko/trustpilot-reviews-scraper": FakeActor(fake_trustpilot_items, latency, failure_rate),
+        "tri_angle/similarweb-scraper": FakeActor(fake_similarweb_items, latency, failure_rate),
+        "compass/crawler-google-places": FakeActor(fake_google_maps_items, latency, failure_rate),
+    }
+
+class CannedRegistry(dict):
+    """Registry where every actor returns its current entry in `items` whatever the run input, or no items."""
+
+    def __init__(self, items: Dict[str, List[Dict[str, Any]]], latency: float = 0.0):
+        super().__init__()
+        self.items = items
+        self.latency = latency
+
+    def __missing__(self, actor_id: str) -> FakeActor:
+        return FakeActor(lambda run_input: list(self.items.get(actor_id, [])), self.latency)
+
+def get_prompt(messages: List[ModelMessage]) -> str:
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                return part.content
+    return ""
+
+def scripted_research_model(searches: int = 2, batch_searches: bool = False) -> FunctionModel:
+    """Research LLM that runs `searches` web searches, then returns a company built from the prompt.
+
+    With `batch_searches`, all searches are sent in one search_google_batch call instead of one turn each.
+    When structured sources already filled some fields, the searches shrink with the fields left to research.
+    """
+    def respond(messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+        match = re.search(r'Research the company "(.+?)"', get_prompt(messages))
+        company_name = match.group(1) if match else "Unknown"
+        done = sum(isinstance(part, ToolReturnPart) for message in messages for part in message.parts)
+        missing = len(info.result_tools[0].parameters_json_schema.get("properties", {}))
+        needed = math.ceil(searches * missing / len(BasicCompanyInfo.model_fields))
+        if batch_searches and not done:
+            queries = [f"{company_name} company overview {i + 1}" for i in range(needed)]
+            return ModelResponse(parts=[ToolCallPart("search_google_batch", {"queries": queries})])
+        if not batch_searches and done < needed:
+            return ModelResponse(parts=[ToolCallPart("search_google", {"query": f"{company_name} company overview {done + 1}"})])
+
+        domain = company_domain(company_name)
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, {
+            "company_name": company_name,
+            "website_url": f"https://{domain}",
+            "short_description": f"{company_name} builds web automation software.",
+            "industry": "Software",
+            "business_model": "Subscription plans",
+            "target_market": "Developers and data teams",
+            "products_services": ["Scraping platform", "Data extraction API"],
+            "founding_year": 2015,
+            "funding_information": "Series A",
+            "estimated_revenue": "$10M-$50M",
+            "employee_count": "120",
+            "competitors": ["Competitor A", "Competitor B"],
+            "market_position": "Challenger",
+            "linkedin_url": f"https://www.linkedin.com/company/{compact_name(company_name)}",
+            "extra_data": "",
+        })])
+    return FunctionModel(respond)
+
+def scripted_section(company_name: str, title: str) -> str:
+    return f"## {title}\n\n{company_name} " + "shows steady growth in a competitive market. " * 20 + "\n\n"
+
+def scripted_report(company_name: str) -> str:
+    sections = ["Executive Summary", "Business Model", "Market Position", "Digital Presence", "Customer Sentiment", "Outlook"]
+    return f"# Business Report for {company_name}\n\n" + "".join(scripted_section(company_name, section) for section in sections)
+
+def scripted_report_model(secs_per_1k_chars: float = 0.0) -> FunctionModel:
+    """Report LLM that returns a fixed multi-section markdown report, or one section when asked for a section.
+
+    Responses are streamed in chunks when requested. With `secs_per_1k_chars`, the text takes time
+    proportional to its length, like a real completion.
+    """
+    def text_for(messages: List[ModelMessage]) -> str:
+        prompt = get_prompt(messages)
+        match = re.search(r"business report for (.+?)\.\n", prompt)
+        company_name = match.group(1) if match else "the company"
+        section = re.search(r'Write the "(.+?)" section', prompt)
+        return scripted_section(company_name, section.group(1)) if section else scripted_report(company_name)
+
+    async def respond(messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+        report = text_for(messages)
+        await asyncio.sleep(len(report) / 1000 * secs_per_1k_chars)
+        if info.result_tools and not info.allow_text_result:
+            return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, {"report": report})])
+        return ModelResponse(parts=[TextPart(report)])
+
+    async def stream(messages: List[ModelMessage], info: AgentInfo) -> AsyncIterator[str]:
+        report = text_for(messages)
+        for i in range(0, len(report), 200):
+            await asyncio.sleep(0.2 * secs_per_1k_chars)
+            yield report[i:i + 200]
+
+    return FunctionModel(respond, stream_function=stream)
+
+class MemoryKeyValueStore:
+    """In-memory stand-in for the default and named key-value stores."""
+
+    def __init__(self):
+        self.records: Dict[str, Any] = {}
+
+    async def set_value(self, key: str, value: Any, content_type: Optional[str] = None) -> None:
+        if value is None:
+            self.records.pop(key, None)
+        else:
+            self.records[key] = value
+
+    async def get_value(self, key: str, default_value: Any = None) -> Any:
+        return self.records.get(key, default_value)
+
+    async def iterate_keys(self) -> AsyncIterator[SimpleNamespace]:
+        for key in list(self.records):
+            yield SimpleNamespace(key=key)
+
+@contextmanager
+def offline_actor(
+    store: MemoryKeyValueStore,
+    batch_searches: bool = False,
+    llm_secs_per_1k_chars: float = 0.0,
+) -> Iterator[Tuple[List[Dict[str, Any]], Counter]]:
+    """Patch storage, billing and both agents' models so the pipeline runs without any API calls.
+
+    Yields the list of pushed dataset items and the counter of charged events.
+    """
+    rows: List[Dict[str, Any]] = []
+    charges: Counter = Counter()
+
+    async def push_data(data: Any, *args, **kwargs) -> None:
+        rows.append(data)
+
+    async def charge(event_name: str, count: int = 1) -> None:
+        charges[event_name] += count
+
+    async def open_key_value_store(*args, **kwargs) -> MemoryKeyValueStore:
+        return store
+
+    with ExitStack() as stack:
+        stack.enter_context(patch.object(Actor, "push_data", new=push_data))
+        stack.enter_context(patch.object(Actor, "charge", new=charge))
+        stack.enter_context(patch.object(Actor, "open_key_value_store", new=open_key_value_store))
+        # Keep every key-value store record in memory instead of local directories
+        stack.enter_context(patch.object(Actor, "is_at_home", return_value=True))
+        stack.enter_context(main.get_research_agent().override(model=scripted_research_model(batch_searches=batch_searches)))
+        stack.enter_context(main.get_business_report_agent().override(model=scripted_report_model(llm_secs_per_1k_chars)))
+        stack.enter_context(main.get_report_section_agent().override(model=scripted_report_model(llm_secs_per_1k_chars)))
+        yield rows, charges
+
+async def run_once(
+    company_names: List[str],
+    actor_input: Dict[str, Any],
+    registry: Dict[str, FakeActor],
+    seed: int = 0,
+    store: Optional[MemoryKeyValueStore] = None,
+    batch_searches: bool = False,
+    llm_secs_per_1k_chars: float = 0.0,
+) -> Dict[str, Any]:
+    """Research the companies once offline and return the run's metrics.
+
+    Pass the same `store` to several runs to keep named key-value store records, e.g. resource
+    profiles, between them.
+    """
+    client = FakeApifyClient(registry, seed)
+    store = store if store is not None else MemoryKeyValueStore()
+    # Each run has its own default store on the platform, so it starts without the billing summary of the last one
+    store.records.pop(BILLING_SUMMARY_KEY, None)
+
+    with offline_actor(store, batch_searches, llm_secs_per_1k_chars) as (rows, charges):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            await main.research_companies(company_names, actor_input, client)
+            wall_time = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    # Token and request counts come from the agent spans of the saved traces
+    agent_spans = [
+        span.get("attrs", {})
+        for key, trace in store.records.items() if key.startswith("trace")
+        for span in trace["spans"] if span["name"].startswith("agent.")
+    ]
+    tokens = sum(attrs.get("total_tokens") or 0 for attrs in agent_spans)
+    return {
+        "companies": len(company_names),
+        "concurrency": actor_input.get("max_concurrency", 3),
+        "wall_time": round(wall_time, 3),
+        "companies_per_minute": round(len(rows) / wall_time * 60, 1) if wall_time else None,
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 2),
+        "rows": len(rows),
+        "actor_calls": dict(client.calls),
+        "total_actor_calls": sum(client.calls.values()),
+        "actor_failures": dict(client.failures),
+        "aborted_runs": len(client.aborted),
+        "memory_mbytes": {
+            actor_id: dict(Counter(run["memory_mbytes"] for run_id, run in client.runs.items() if run["actor_id"] == actor_id))
+            for actor_id in client.calls
+        },
+        "compute_units": round(sum(
+            run["memory_mbytes"] / 1024 * (min(run["finishes_at"], time.perf_counter()) - run["started_at"]) / 3600
+            for run in client.runs.values()
+        ), 6),
+        "timed_out_sources": dict(Counter(source for row in rows for source in row.get("timed_out_sources", []))),
+        "llm_tokens": tokens,
+        "llm_requests": sum(attrs.get("requests") or 0 for attrs in agent_spans),
+        "report_cache_hits": sum(row.get("run_metrics", {}).get("report_cache_hits", 0) for row in rows),
+        "report_time": round(sum(row.get("run_metrics", {}).get("report_generation_time", 0) for row in rows) / max(1, len(rows)), 3),
+        "charged_events": dict(charges),
+        "charge_calls": store.records.get(BILLING_SUMMARY_KEY, {}).get("charge_calls", 0),
+    }
+
+async def run_benchmark(
+    companies: int = 10,
+    concurrency: int = 5,
+    latency: float = 0.5,
+    failure_rate: float = 0.0,
+    actor_input: Optional[Dict[str, Any]] = None,
+    seed: int = 0,
+    batch_searches: bool = False,
+    llm_secs_per_1k_chars: float = 0.0,
+) -> Dict[str, Any]:
+    """Run the synthetic companies sequentially and concurrently and report the speedup."""
+    company_names = [f"Synthetic Company {i + 1}" for i in range(companies)]
+    registry = default_registry(latency, failure_rate)
+    # Offline runs must not share results through the scraper cache
+    base_input = {"use_cache": False, "save_trace": True, **(actor_input or {})}
+
+    scripted = {"batch_searches": batch_searches, "llm_secs_per_1k_chars": llm_secs_per_1k_chars}
+    sequential = await run_once(company_names, {**base_input, "max_concurrency": 1}, registry, seed, **scripted)
+    concurrent = await run_once(company_names, {**base_input, "max_concurrency": concurrency}, registry, seed, **scripted)
+    return {
+        "sequential": sequential,
+        "concurrent": concurrent,
+        "speedup": round(sequential["wall_time"] / concurrent["wall_time"], 2) if concurrent["wall_time"] else None,
+    }
+
+def parse_reviews_by_hand(items: List[Dict[str, Any]]) -> List[TrustpilotReview]:
+    """Per-item model construction with a .get() per field, as the tools did before the mapping layer."""
+    return [
+        TrustpilotReview(
+            reviewUrl=item.get("reviewUrl", ""),
+            authorName=item.get("authorName", ""),
+            datePublished=item.get("datePublished", ""),
+            reviewHeadline=item.get("reviewHeadline", ""),
+            reviewBody=item.get("reviewBody", ""),
+            reviewLanguage=item.get("reviewLanguage", ""),
+            ratingValue=item.get("ratingValue", 0),
+            verificationLevel=item.get("verificationLevel", ""),
+            numberOfReviews=item.get("numberOfReviews", 0),
+            consumerCountryCode=item.get("consumerCountryCode", ""),
+            experienceDate=item.get("experienceDate", ""),
+            likes=item.get("likes", 0),
+        )
+        for item in items
+    ]
+
+def benchmark_parsing(reviews: int = 1000, repeat: int = 20) -> Dict[str, Any]:
+    """Compare hand-written review parsing with the compiled mapping on one review payload."""
+    items = fake_trustpilot_items({"companyDomain": "example.com", "count": reviews}) * (reviews // 20 + 1)
+    items = items[:reviews]
+    TRUSTPILOT_MAPPING.validate_many(items[:1])  # Compile outside the timed runs
+
+    timings = {}
+    for name, parse in (("hand_written", parse_reviews_by_hand), ("mapping", TRUSTPILOT_MAPPING.validate_many)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse(items)
+        timings[name] = (time.perf_counter() - start) / repeat
+
+    return {
+        "reviews": reviews,
+        "hand_written_ms": round(timings["hand_written"] * 1000, 2),
+        "mapping_ms": round(timings["mapping"] * 1000, 2),
+        "speedup": round(timings["hand_written"] / timings["mapping"], 2),
+    }
+
+# Repository root, where `python -m src` starts the Actor
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_importtime(output: str, module: str, top: int = 10) -> Dict[str, Any]:
+    """Read `python -X importtime` output: the cumulative import time of `module` and of its slowest direct imports, in ms."""
+    total = None
+    imports: Dict[str, float] = {}
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if not match:
+            continue
+        cumulative_ms, depth, name = int(match.group(2)) / 1000, len(match.group(3)), match.group(4)
+        if name == module and depth == 0:
+            total = cumulative_ms
+        elif depth == 2:
+            imports[name] = cumulative_ms
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {"total_ms": total, "slowest_imports_ms": {name: round(ms, 1) for name, ms in slowest}}
+
+def measure_startup(module: str = "src.main", runs: int = 5) -> Dict[str, Any]:
+    """Median import time of `module` and time to the Actor's first log line, each in fresh interpreters.
+
+    The Actor is started without input and with a throwaway local storage, so it logs its start and exits.
+    """
+    imports = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+        )
+        imports.append(parse_importtime(result.stderr, module))
+
+    first_log, exit_times = [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as storage_dir:
+            env = {**os.environ, "APIFY_LOCAL_STORAGE_DIR": storage_dir, "CRAWLEE_STORAGE_DIR": storage_dir}
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, "-m", "src"], cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+            )
+            for line in process.stdout:
+                if line.strip():
+                    first_log.append(time.perf_counter() - start)
+                    break
+            process.communicate()
+            exit_times.append(time.perf_counter() - start)
+
+    median_import = statistics.median(run["total_ms"] for run in imports if run["total_ms"] is not None)
+    return {
+        "module": module,
+        "runs": runs,
+        "import_ms": round(median_import, 1),
+        "first_log_secs": round(statistics.median(first_log), 3) if first_log else None,
+        "exit_secs": round(statistics.median(exit_times), 3),
+        # The slowest direct imports of the run with the median import time
+        "slowest_imports_ms": min(imports, key=lambda run: abs((run["total_ms"] or 0) - median_import))["slowest_imports_ms"],
+    }
+
+def append_history(path: str, result: Dict[str, Any]) -> None:
+    """Append a start-up measurement with its time and commit to a JSON lines file to track it across changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"timestamp": round(time.time()), "commit": commit or None, **result}) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the research pipeline offline.")
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds every fake actor run takes")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a fake actor run fails to start")
+    parser.add_argument("--input", type=json.loads, default={}, help="Extra Actor input as JSON, e.g. '{\"batch_scrapers\": false}'")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-searches", action="store_true", help="Let the scripted research LLM send all its searches in one search_google_batch call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the scripted report LLM takes per 1,000 characters of output")
+    parser.add_argument("--parsing", action="store_true", help="Only benchmark parsing 1,000 Trustpilot reviews")
+    parser.add_argument("--startup", action="store_true", help="Only measure the import time of src.main and the time to the Actor's first log line")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per start-up measurement")
+    parser.add_argument("--history", help="JSON lines file to append the start-up measurement to, e.g. .benchmarks/startup.jsonl")
+    args = parser.parse_args()
+
+    logging.getLogger(Actor.log.name).setLevel(logging.WARNING)
+    if args.parsing:
+        result = benchmark_parsing()
+    elif args.startup:
+        result = measure_startup(runs=args.runs)
+        if args.history:
+            append_history(args.history, result)
+    else:
+        result = asyncio.run(run_benchmark(
+            args.companies, args.concurrency, args.latency, args.failure_rate, args.input, args.seed, args.batch_searches,
+            args.llm_latency,
+        ))
+    print(json.dumps(result, indent=2))
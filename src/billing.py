@@ -0,0 +1,218 @@
+from apify import Actor, Event
+from typing import Any, Dict, Optional
+from collections import Counter
+from contextvars import ContextVar
+import asyncio
+import contextlib
+import time
+
+# Record of the default key-value store with the charges of the run, also used to resume after a migration
+BILLING_SUMMARY_KEY = "billing_summary"
+
+# Event charged per started 1,000 LLM tokens of the whole run
+LLM_TOKENS_EVENT = "1k-llm-tokens"
+
+class ChargeLedger:
+    """Pay-per-event charges collected in memory and sent to the platform in batches.
+
+    Pending charges are flushed every `flush_secs`, as soon as `flush_events` events are pending,
+    and when the ledger is closed. A failed charge stays pending and is retried on the next flush.
+    The charged and pending counts are saved to the default key-value store after every flush and
+    whenever the platform asks to persist state, so a run that migrates resumes from them.
+    LLM tokens are summed over the run and charged per started 1,000 of the total, not per call.
+    Without `save_summary`, the counts are only kept in memory.
+    """
+
+    def __init__(self, flush_secs: float = 10.0, flush_events: int = 100, save_summary: bool = True):
+        self.flush_secs = flush_secs
+        self.flush_events = max(1, flush_events)
+        self.save_summary = save_summary
+        self.pending: Counter = Counter()
+        self.requested: Counter = Counter()
+        self.charged: Counter = Counter()
+        # Events not charged because the run reached its maximum total charge
+        self.over_limit: Counter = Counter()
+        self.limit_reached = set()
+        self.llm_tokens = 0
+        self.billed_llm_tokens = 0
+        self.flushes = 0
+        self.charge_calls = 0
+        self.failed_charges = 0
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._listening = False
+
+    @property
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "charged": dict(self.charged),
+            "requested": dict(self.requested),
+            "pending": dict(self.pending),
+            "over_limit": dict(self.over_limit),
+            "llm_tokens": self.llm_tokens,
+            "billed_llm_tokens": self.billed_llm_tokens,
+            "flushes": self.flushes,
+            "charge_calls": self.charge_calls,
+            "failed_charges": self.failed_charges,
+            "updated_at": round(time.time()),
+        }
+
+    def add(self, event_name: str, count: int = 1) -> None:
+        """Queue `count` events, flushing in the background once enough are pending."""
+        if count <= 0:
+            return
+        self.requested[event_name] += count
+        if event_name in self.limit_reached:
+            self.over_limit[event_name] += count
+            return
+        self.pending[event_name] += count
+        if sum(self.pending.values()) >= self.flush_events and not (self._flush_task and not self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def add_tokens(self, tokens: Optional[int]) -> None:
+        """Count LLM tokens and queue a charge for every full 1,000 of the run total, the rest is charged on close."""
+        self.llm_tokens += tokens or 0
+        full = self.llm_tokens // 1000 - self.billed_llm_tokens // 1000
+        if full > 0:
+            self.billed_llm_tokens += full * 1000
+            self.add(LLM_TOKENS_EVENT, full)
+
+    async def flush(self) -> None:
+        """Charge every pending event with one call per event type and save the ledger."""
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, Counter()
+            self.flushes += 1
+            for event_name, count in batch.items():
+                self.charge_calls += 1
+                try:
+                    result = await Actor.charge(event_name, count)
+                except Exception as e:
+                    self.failed_charges += 1
+                    self.pending[event_name] += count
+                    Actor.log.warning(f"Failed to charge {count} {event_name} events, retrying on the next flush: {str(e)}")
+                    continue
+                charged = getattr(result, "charged_count", count)
+                charged = charged if isinstance(charged, int) else count
+                self.charged[event_name] += charged
+                if charged < count and getattr(result, "event_charge_limit_reached", False) is True:
+                    self.over_limit[event_name] += count - charged
+                    self.limit_reached.add(event_name)
+                    Actor.log.warning(f"The maximum total charge of the run is reached, no more {event_name} events are charged")
+            await self.save()
+
+    async def load(self) -> None:
+        """Resume the counts saved by an earlier instance of this run, e.g. before a migration."""
+        try:
+            store = await Actor.open_key_value_store()
+            state = await store.get_value(BILLING_SUMMARY_KEY)
+        except Exception as e:
+            Actor.log.warning(f"Failed to load the billing summary: {str(e)}")
+            return
+        if not state:
+            return
+        self.charged.update(state.get("charged") or {})
+        self.requested.update(state.get("requested") or {})
+        self.pending.update(state.get("pending") or {})
+        self.over_limit.update(state.get("over_limit") or {})
+        self.llm_tokens += state.get("llm_tokens", 0)
+        self.billed_llm_tokens += state.get("billed_llm_tokens", 0)
+        if self.pending:
+            Actor.log.info(f"Resuming {sum(self.pending.values())} pending charges of an earlier instance of this run")
+
+    async def save(self) -> None:
+        if not self.save_summary:
+            return
+        try:
+            store = await Actor.open_key_value_store()
+            await store.set_value(BILLING_SUMMARY_KEY, self.summary)
+        except Exception as e:
+            Actor.log.warning(f"Failed to save the billing summary: {str(e)}")
+
+    async def _on_persist_state(self, event_data: Any) -> None:
+        # Charge what is pending before the run moves to another server, the counts are saved either way
+        if getattr(event_data, "is_migrating", False):
+            await self.flush()
+        await self.save()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_secs)
+            # Closing the ledger cancels the timer, but never a flush that is sending charges
+            await asyncio.shield(self.flush())
+
+    async def start(self) -> None:
+        """Load the saved counts, start the flush timer and persist the ledger with the Actor's state."""
+        await self.load()
+        if self.flush_secs > 0:
+            self._timer = asyncio.create_task(self._flush_periodically())
+        try:
+            Actor.on(Event.PERSIST_STATE, self._on_persist_state)
+            self._listening = True
+        except RuntimeError:
+            # Outside of `async with Actor`, e.g. in tests, there are no platform events
+            pass
+
+    async def close(self) -> None:
+        """Charge the started 1,000 LLM tokens and everything pending, then save the summary."""
+        if self._timer:
+            self._timer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._timer
+            self._timer = None
+        if self._listening:
+            Actor.off(Event.PERSIST_STATE, self._on_persist_state)
+            self._listening = False
+        if self.llm_tokens > self.billed_llm_tokens:
+            self.billed_llm_tokens += 1000
+            self.add(LLM_TOKENS_EVENT, 1)
+        if self._flush_task:
+            await self._flush_task
+        await self.flush()
+        await self.save()
+        Actor.log.info(f"Billing summary: {self.summary['charged']} in {self.charge_calls} charge calls")
+
+# The ledger of the current run or standby request, inherited by every task started within it
+current_ledger: ContextVar[Optional[ChargeLedger]] = ContextVar("current_ledger", default=None)
+
+# Ledger of the charges made outside of a run or request, e.g. by a tool called on its own
+_fallback_ledger: Optional[ChargeLedger] = None
+
+def get_fallback_ledger() -> ChargeLedger:
+    global _fallback_ledger
+    if _fallback_ledger is None:
+        _fallback_ledger = ChargeLedger(flush_secs=0, save_summary=False)
+    return _fallback_ledger
+
+async def close_fallback_ledger() -> None:
+    """Charge the started 1,000 LLM tokens and anything else left on the fallback ledger, e.g. on exit."""
+    global _fallback_ledger
+    if _fallback_ledger is not None:
+        ledger, _fallback_ledger = _fallback_ledger, None
+        await ledger.close()
+
+async def charge(event_name: str, count: int = 1) -> None:
+    """Queue events on the current ledger, or charge them right away through the fallback ledger without one."""
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.add(event_name, count)
+    elif count > 0:
+        ledger = get_fallback_ledger()
+        ledger.add(event_name, count)
+        await ledger.flush()
+
+async def charge_tokens(tokens: Optional[int]) -> None:
+    """Queue LLM tokens on the current ledger, or on the fallback ledger without one.
+
+    Either way tokens are charged per started 1,000 of the total: the fallback ledger charges every full
+    1,000 right away and the started rest when it is closed.
+    """
+    ledger = current_ledger.get()
+    if ledger is None:
+        ledger = get_fallback_ledger()
+        ledger.add_tokens(tokens)
+        await ledger.flush()
+    else:
+        ledger.add_tokens(tokens)
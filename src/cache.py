@@ -0,0 +1,446 @@
+from apify import Actor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import urlparse
+from pydantic import BaseModel, TypeAdapter
+from collections import OrderedDict
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import time
+from .tracing import span
+
+# Time to live of cached scraper results per source, in days
+DEFAULT_CACHE_TTL_DAYS = {
+    "linkedin": 7,
+    "trustpilot": 1,
+    "similarweb": 30,
+    "google_maps": 7,
+    "search": 1,
+}
+
+# Words that do not change the intent of a research query
+QUERY_STOPWORDS = {
+    "a", "an", "and", "are", "about", "at", "by", "for", "from", "in", "is", "of", "on", "or", "the", "to", "with",
+    "what", "who", "when", "where", "which", "how", "does", "do", "its", "it",
+    "inc", "incorporated", "ltd", "llc", "corp", "corporation", "co", "gmbh", "plc", "sa", "ag",
+    "company", "companies", "info", "information", "details", "rounds", "round", "latest", "recent",
+}
+
+# Plurals folded into their singular. Only these words: stripping any trailing "s" turns "news" into "new"
+# and "analytics" into "analytic", and lets queries with different meanings share results.
+QUERY_PLURALS = {
+    "competitors": "competitor", "employees": "employee", "founders": "founder", "investors": "investor",
+    "executives": "executive", "products": "product", "services": "service", "customers": "customer",
+    "reviews": "review", "acquisitions": "acquisition", "partners": "partner", "offices": "office",
+    "subsidiaries": "subsidiary", "revenues": "revenue", "ratings": "rating",
+}
+
+# Part of every search memo key, bumped when the normalization or the stored results change so stale keys are not reused
+SEARCH_KEY_VERSION = 3
+
+def canonical_domain(url: str) -> str:
+    """Reduce a website URL or domain to its bare lowercase domain, e.g. https://www.Apify.com/about -> apify.com"""
+    url = url.strip().lower()
+    if not url.startswith(('http://', 'https://')):
+        url = f"https://{url}"
+    domain = urlparse(url).netloc.split(":")[0]
+    return re.sub(r'^www\.', '', domain)
+
+def canonical_linkedin_url(url: str) -> str:
+    """Reduce a LinkedIn company URL to linkedin.com/company/<slug>."""
+    match = re.search(r'linkedin\.com/company/([^/?#]+)', url.strip().lower())
+    if match:
+        return f"linkedin.com/company/{match.group(1)}"
+    return url.strip().lower().rstrip("/")
+
+def canonical_query(query: str) -> str:
+    """Normalize a free text query by lowercasing it and collapsing whitespace."""
+    return " ".join(query.lower().split())
+
+def canonical_search_query(query: str) -> str:
+    """Normalize a search query so that near-identical queries map to the same key.
+
+    Lowercases, strips punctuation and stopwords, folds common plurals and sorts the remaining tokens,
+    e.g. "Acme Inc. funding" and "funding of ACME" both become "acme funding".
+    """
+    tokens = re.findall(r"[a-z0-9]+", query.lower())
+    tokens = [QUERY_PLURALS.get(token, token) for token in tokens if token not in QUERY_STOPWORDS]
+    return " ".join(sorted(set(tokens))) or canonical_query(query)
+
+CANONICALIZERS = {
+    "linkedin": canonical_linkedin_url,
+    "trustpilot": canonical_domain,
+    "similarweb": canonical_domain,
+    "google_maps": canonical_query,
+}
+
+class StoreBackedCache:
+    """JSON records in a named Apify key-value store when running on the platform,
+    or in a local directory when running offline.
+
+    With `memory_entries`, the most recently used records are also kept in memory, so that a
+    long-lived process such as the standby server reads each record from the store only once.
+    """
+
+    def __init__(self, store_name: str = "company-researcher-cache", local_dir: Optional[str] = None, memory_entries: int = 0):
+        self.store_name = store_name
+        self.local_dir = local_dir
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._store = None
+
+    def _remember(self, key: str, entry: Optional[Dict[str, Any]]) -> None:
+        if not self.memory_entries:
+            return
+        if entry is None:
+            self._memory.pop(key, None)
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        entry = await self._read_store(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    async def _read_store(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.local_dir:
+            path = os.path.join(self.local_dir, f"{key}.json")
+            if not os.path.exists(path):
+                return None
+
+            def read_file() -> Dict[str, Any]:
+                with open(path, encoding="utf-8") as f:
+                    return json.load(f)
+
+            return await asyncio.to_thread(read_file)
+
+        if self._store is None:
+            self._store = await Actor.open_key_value_store(name=self.store_name)
+        return await self._store.get_value(key)
+
+    async def _list_keys(self, prefix: str) -> List[str]:
+        """Keys of the records in the store that start with `prefix`."""
+        if self.local_dir:
+            if not os.path.isdir(self.local_dir):
+                return []
+            names = await asyncio.to_thread(os.listdir, self.local_dir)
+            return [name[:-len(".json")] for name in names if name.startswith(prefix) and name.endswith(".json")]
+
+        if self._store is None:
+            self._store = await Actor.open_key_value_store(name=self.store_name)
+        return [info.key async for info in self._store.iterate_keys() if info.key.startswith(prefix)]
+
+    async def _write(self, key: str, entry: Optional[Dict[str, Any]]) -> None:
+        """Write a record, or delete it when `entry` is None."""
+        await self._write_store(key, entry)
+        self._remember(key, entry)
+
+    async def _write_store(self, key: str, entry: Optional[Dict[str, Any]]) -> None:
+        with span("kv.set_value", key=key, store=self.store_name):
+            if self.local_dir:
+                path = os.path.join(self.local_dir, f"{key}.json")
+
+                def write_file() -> None:
+                    if entry is None:
+                        if os.path.exists(path):
+                            os.remove(path)
+                        return
+                    os.makedirs(self.local_dir, exist_ok=True)
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(entry, f)
+
+                await asyncio.to_thread(write_file)
+                return
+
+            if self._store is None:
+                self._store = await Actor.open_key_value_store(name=self.store_name)
+            await self._store.set_value(key, entry)
+
+class ScraperCache(StoreBackedCache):
+    """Cross-run cache of parsed scraper results.
+
+    Entries live in a named Apify key-value store when running on the platform,
+    or in a local directory when running offline.
+    """
+
+    def __init__(
+        self,
+        store_name: str = "company-researcher-cache",
+        local_dir: Optional[str] = None,
+        ttl_days: Optional[Dict[str, float]] = None,
+        memory_entries: int = 0,
+    ):
+        super().__init__(store_name, local_dir, memory_entries)
+        self.ttl_days = {**DEFAULT_CACHE_TTL_DAYS, **(ttl_days or {})}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def make_key(self, source: str, target: str) -> str:
+        """Build a key-value store safe key from the canonical form of the target."""
+        canonical = CANONICALIZERS.get(source, canonical_query)(target)
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+        return f"{source}_{digest}"
+
+    def _record(self, source: str, outcome: str) -> None:
+        source_stats = self.stats.setdefault(source, {"hits": 0, "misses": 0})
+        source_stats[outcome] += 1
+
+    async def get(self, source: str, target: str, adapter: TypeAdapter, max_age_days: Optional[float] = None) -> Optional[Any]:
+        """Return the cached parsed result for the target, or None on a miss or an entry older than
+        the source TTL or `max_age_days`, whichever is shorter."""
+        try:
+            entry = await self._read(self.make_key(source, target))
+        except Exception as e:
+            Actor.log.warning(f"Failed to read {source} cache entry for {target}: {str(e)}")
+            entry = None
+
+        max_age = self.ttl_days.get(source, 1) * 24 * 3600
+        if max_age_days is not None:
+            max_age = min(max_age, max_age_days * 24 * 3600)
+        if not entry or time.time() - entry.get("created_at", 0) > max_age:
+            self._record(source, "misses")
+            return None
+
+        try:
+            value = adapter.validate_python(entry["data"])
+        except Exception as e:
+            Actor.log.warning(f"Discarding invalid {source} cache entry for {target}: {str(e)}")
+            self._record(source, "misses")
+            return None
+
+        self._record(source, "hits")
+        Actor.log.info(f"Cache hit for {source}: {target}")
+        return value
+
+    async def set(self, source: str, target: str, adapter: TypeAdapter, value: Any) -> None:
+        """Store a parsed result for the target."""
+        entry = {
+            "created_at": time.time(),
+            "target": target,
+            "data": adapter.dump_python(value, mode="json"),
+        }
+        try:
+            await self._write(self.make_key(source, target), entry)
+        except Exception as e:
+            Actor.log.warning(f"Failed to write {source} cache entry for {target}: {str(e)}")
+
+def is_empty_result(value: Any) -> bool:
+    """Check whether a scraper result is an empty list or a model with only default values."""
+    if isinstance(value, BaseModel):
+        return value == type(value)()
+    return not value
+
+def cached(source: str, result_type: Any) -> Callable:
+    """Serve an enrichment function `fn(deps, target)` from `deps.cache` when a fresh entry exists.
+
+    Empty results are not cached so that failed or blocked scrapes are retried on the next run.
+    """
+    adapter = TypeAdapter(result_type)
+
+    def decorator(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(fn)
+        async def wrapper(deps, target: str, *args, **kwargs):
+            cache = getattr(deps, "cache", None)
+            if cache is None:
+                return await fn(deps, target, *args, **kwargs)
+
+            max_age_days = getattr(deps, "cache_max_age_days", {}).get(source)
+            value = await cache.get(source, target, adapter, max_age_days)
+            if value is not None:
+                return value
+
+            value = await fn(deps, target, *args, **kwargs)
+            # Partial results of a source that ran out of time are not worth keeping
+            if not is_empty_result(value) and source not in getattr(deps, "timed_out_sources", ()):
+                await cache.set(source, target, adapter, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+class SearchMemo:
+    """Memoizes search results by normalized query within a run and, with a cache, across runs."""
+
+    def __init__(self, cache: Optional[ScraperCache] = None):
+        self.cache = cache
+        self.results: Dict[str, List[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._adapter = TypeAdapter(List[str])
+
+    async def get_or_run(self, query: str, max_results: int, run: Callable[[], Awaitable[List[str]]], max_age_days: Optional[float] = None) -> List[str]:
+        """Return memoized results for an equivalent query, or run the search once and remember it.
+
+        Results cached by earlier runs are only served when younger than `max_age_days`, if given.
+        """
+        key = f"v{SEARCH_KEY_VERSION} {canonical_search_query(query)} {max_results}"
+        if key in self.results:
+            self.hits += 1
+            Actor.log.info(f"Reusing search results for: {query}")
+            return self.results[key]
+
+        # Concurrent equivalent queries wait for the search already in progress
+        if key in self._in_flight:
+            self.hits += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            results = await self.cache.get("search", key, self._adapter, max_age_days) if self.cache else None
+            if results is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                results = await run()
+                if self.cache and results:
+                    await self.cache.set("search", key, self._adapter, results)
+            # Empty results may come from a failed or timed out search, let a later query retry
+            if results:
+                self.results[key] = results
+            future.set_result(results)
+            return results
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when no other caller is waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+COMPLETION_INDEX_KEY = "completion_index"
+
+def completion_key(model_name: str, system_prompt: str, settings: Optional[Dict[str, Any]], prompt: str) -> str:
+    """Content address of a completion: a hash of everything that determines the model's answer."""
+    payload = json.dumps(
+        {"model": model_name, "system_prompt": system_prompt, "settings": settings or {}, "prompt": prompt},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return f"completion_{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}"
+
+class CompletionCache(StoreBackedCache):
+    """Cross-run cache of agent completions keyed by their content address, with LRU eviction.
+
+    The last use of every entry is kept in an index record, entries beyond `max_entries` are
+    deleted starting with the least recently used one. The index is saved after every new entry and
+    merged with the index in the store, so runs that overlap or crash don't lose entries from it.
+    On load, entries found in the store but missing from the index are added as least recently used.
+    """
+
+    def __init__(
+        self,
+        store_name: str = "company-researcher-cache",
+        local_dir: Optional[str] = None,
+        max_entries: int = 500,
+        memory_entries: int = 0,
+    ):
+        super().__init__(store_name, local_dir, memory_entries)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._index: Optional[Dict[str, float]] = None
+        # Entries deleted by this instance, never merged back from the index in the store
+        self._evicted: Set[str] = set()
+        self._lock = asyncio.Lock()
+
+    async def _read_index(self) -> Dict[str, float]:
+        """The index as saved in the store, possibly by another run."""
+        return (await self._read_store(COMPLETION_INDEX_KEY) or {}).get("last_used", {})
+
+    async def _load_index(self) -> Dict[str, float]:
+        async with self._lock:
+            if self._index is None:
+                try:
+                    index = await self._read_index()
+                    keys = set(await self._list_keys("completion_")) - {COMPLETION_INDEX_KEY}
+                    # Entries written by a run that never saved its index would otherwise never be evicted
+                    self._index = {key: index.get(key, 0.0) for key in keys}
+                except Exception as e:
+                    Actor.log.warning(f"Failed to read the completion cache index: {str(e)}")
+                    self._index = {}
+        return self._index
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached `{"text": ..., "usage": {...}}` completion, or None on a miss."""
+        index = await self._load_index()
+        entry = None
+        if key in index:
+            try:
+                entry = await self._read(key)
+            except Exception as e:
+                Actor.log.warning(f"Failed to read completion cache entry {key}: {str(e)}")
+
+        if not entry or "text" not in entry:
+            index.pop(key, None)
+            self.misses += 1
+            return None
+
+        index[key] = time.time()
+        self.hits += 1
+        self.saved_tokens += (entry.get("usage") or {}).get("total_tokens") or 0
+        return entry
+
+    async def set(self, key: str, text: str, usage: Dict[str, Any]) -> None:
+        """Store a completion and evict the least recently used entries over `max_entries`."""
+        index = await self._load_index()
+        try:
+            await self._write(key, {"created_at": time.time(), "text": text, "usage": usage})
+        except Exception as e:
+            Actor.log.warning(f"Failed to write completion cache entry {key}: {str(e)}")
+            return
+        index[key] = time.time()
+        self._evicted.discard(key)
+        await self.save()
+
+    async def _evict(self, index: Dict[str, float]) -> None:
+        for evicted in sorted(index, key=index.get)[:max(0, len(index) - self.max_entries)]:
+            del index[evicted]
+            self._evicted.add(evicted)
+            try:
+                await self._write(evicted, None)
+            except Exception as e:
+                Actor.log.warning(f"Failed to evict completion cache entry {evicted}: {str(e)}")
+
+    async def save(self) -> None:
+        """Merge the LRU index with the one in the store, evict the entries over `max_entries` and persist it."""
+        if self._index is None:
+            return
+        async with self._lock:
+            try:
+                for key, last_used in (await self._read_index()).items():
+                    if key not in self._evicted and last_used > self._index.get(key, -1.0):
+                        self._index[key] = last_used
+                await self._evict(self._index)
+                await self._write(COMPLETION_INDEX_KEY, {"last_used": self._index})
+            except Exception as e:
+                Actor.log.warning(f"Failed to save the completion cache index: {str(e)}")
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "saved_tokens": self.saved_tokens,
+            "entries": len(self._index or {}),
+        }
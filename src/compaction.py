@@ -0,0 +1,120 @@
+from typing import Any, Dict, List, Tuple
+import json
+from .models import CompanyInfo
+
+# Rough characters-per-token ratio for JSON payloads
+CHARS_PER_TOKEN = 4
+
+# Fields that add tokens without adding information for the report
+OMITTED_FIELDS = {
+    "trustpilot_data": {"reviewUrl", "authorName"},
+    "google_maps_data": {"street", "city", "postalCode", "countryCode"},
+    "google_maps_reviews": {"reviewerUrl", "name"},
+}
+
+# Lists trimmed first when the payload exceeds the token budget, lowest priority first
+TRIM_ORDER: List[Tuple[str, ...]] = [
+    ("similarweb_data", "topInterestedWebsites"),
+    ("similarweb_data", "adsSources"),
+    ("similarweb_data", "topReferrals"),
+    ("similarweb_data", "topKeywords"),
+    ("similarweb_data", "socialNetworkDistribution"),
+    ("similarweb_data", "topCountries"),
+    ("google_maps_data", "*", "reviews"),
+    ("trustpilot_data",),
+    ("latest_news",),
+    ("similarweb_data", "topSimilarityCompetitors"),
+    ("linkedin_data", "specialties"),
+]
+
+def to_compact_json(data: Any) -> str:
+    """Serialize data as JSON without indentation or extra whitespace."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def estimate_tokens(data: Any) -> int:
+    """Estimate the number of LLM tokens the compact JSON of the data will take."""
+    return len(to_compact_json(data)) // CHARS_PER_TOKEN + 1
+
+def prune_empty(value: Any, drop_zeros: bool = False) -> Any:
+    """Recursively drop None, empty strings, empty containers and, optionally, zero placeholders."""
+    if isinstance(value, dict):
+        pruned = {k: prune_empty(v, drop_zeros) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if not is_empty_value(v, drop_zeros)}
+    if isinstance(value, list):
+        pruned = [prune_empty(v, drop_zeros) for v in value]
+        return [v for v in pruned if not is_empty_value(v, drop_zeros)]
+    return value
+
+def is_empty_value(value: Any, drop_zeros: bool = False) -> bool:
+    if value is None or value == [] or value == {}:
+        return True
+    if isinstance(value, str):
+        # Strings like ", , " come from joining missing address parts
+        return not value.strip(" ,")
+    if drop_zeros and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value == 0
+    return False
+
+def compact_similarweb(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop the Similarweb zero placeholders and the duplicated age bucket fields."""
+    age = data.get("ageDistribution") or {}
+    groups = age.get("groups") or []
+    if groups:
+        # The flat age18_24-style fields duplicate the groups, keep a single compact mapping
+        data["ageDistribution"] = {
+            (f"{g.get('minAge')}-{g.get('maxAge')}" if g.get("maxAge") else f"{g.get('minAge')}+"): g.get("value")
+            for g in groups if g.get("value") is not None
+        }
+    return prune_empty(data, drop_zeros=True)
+
+def compact_company_data(company_info: CompanyInfo) -> Dict[str, Any]:
+    """Dump the company data without defaults, empty values and redundant representations."""
+    data = company_info.model_dump(exclude={"report", "run_metrics", "timed_out_sources", "material_changes", "failed_report_sections", "competitor_of"}, exclude_defaults=True)
+
+    if "similarweb_data" in data:
+        data["similarweb_data"] = compact_similarweb(data["similarweb_data"])
+
+    if "linkedin_data" in data and data["linkedin_data"].get("website") == company_info.website_url:
+        data["linkedin_data"].pop("website")
+
+    for review in data.get("trustpilot_data", []):
+        for field in OMITTED_FIELDS["trustpilot_data"]:
+            review.pop(field, None)
+
+    for place in data.get("google_maps_data", []):
+        if place.get("address"):
+            for field in OMITTED_FIELDS["google_maps_data"]:
+                place.pop(field, None)
+        for review in place.get("reviews", []):
+            for field in OMITTED_FIELDS["google_maps_reviews"]:
+                review.pop(field, None)
+
+    return prune_empty(data)
+
+def get_lists_at_path(data: Dict[str, Any], path: Tuple[str, ...]) -> List[List[Any]]:
+    """Resolve a trim path to the lists it points at, expanding "*" over list elements."""
+    nodes: List[Any] = [data]
+    for part in path:
+        next_nodes = []
+        for node in nodes:
+            if part == "*" and isinstance(node, list):
+                next_nodes.extend(node)
+            elif isinstance(node, dict) and part in node:
+                next_nodes.append(node[part])
+        nodes = next_nodes
+    return [node for node in nodes if isinstance(node, list)]
+
+def fit_to_token_budget(data: Dict[str, Any], token_budget: int) -> Dict[str, Any]:
+    """Halve the lowest-priority lists in TRIM_ORDER until the payload fits the token budget."""
+    for path in TRIM_ORDER:
+        if estimate_tokens(data) <= token_budget:
+            break
+        for items in get_lists_at_path(data, path):
+            while items and estimate_tokens(data) > token_budget:
+                del items[len(items) // 2:]
+    return prune_empty(data)
+
+def prepare_company_data_for_report(company_info: CompanyInfo, token_budget: int = 20000) -> Dict[str, Any]:
+    """Prepare a compact dictionary of company data for the report agent that fits the token budget."""
+    data = compact_company_data(company_info)
+    return fit_to_token_budget(data, token_budget)
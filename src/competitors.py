@@ -0,0 +1,90 @@
+from typing import Iterable, List, Optional, Set
+from .cache import canonical_domain, canonical_linkedin_url
+from .models import CompanyInfo
+from .prefill import DOMAIN_PATTERN
+from .speculation import compact_name
+
+def company_keys(text: str) -> Set[str]:
+    """Keys under which a company given by name, domain or LinkedIn URL is deduplicated.
+
+    A domain also yields its compact main label, so that "globex.com" and "Globex Inc" match.
+    """
+    text = text.strip()
+    if not text:
+        return set()
+    if "linkedin.com/company/" in text.lower():
+        return {canonical_linkedin_url(text)}
+    if DOMAIN_PATTERN.match(text):
+        domain = canonical_domain(text)
+        return {domain, compact_name(domain.split(".")[0])}
+    return {compact_name(text)} - {""}
+
+def researched_keys(company_name: str, company_info: CompanyInfo) -> Set[str]:
+    """Keys of a researched company: its input, the name it was researched under and its website and LinkedIn page."""
+    keys = company_keys(company_name) | company_keys(company_info.company_name)
+    for url in (company_info.website_url, company_info.linkedin_url):
+        if url:
+            keys |= company_keys(url)
+    return keys
+
+def pick_competitors(company_info: CompanyInfo, count: int, skip: Iterable[str] = ()) -> List[str]:
+    """The first `count` distinct competitors other than the company itself, Similarweb domains first, then the names found by the research agent."""
+    seen = set(skip) | researched_keys(company_info.company_name, company_info)
+    candidates = [competitor.domain for competitor in company_info.similarweb_data.topSimilarityCompetitors if competitor.domain]
+    picked = []
+    for candidate in candidates + company_info.competitors:
+        keys = company_keys(candidate)
+        if not keys or keys & seen:
+            continue
+        seen |= keys
+        picked.append(candidate)
+        if len(picked) == count:
+            break
+    return picked
+
+def trustpilot_rating(company_info: CompanyInfo) -> Optional[str]:
+    ratings = [review.ratingValue for review in company_info.trustpilot_data if review.ratingValue]
+    if not ratings:
+        return None
+    return f"{sum(ratings) / len(ratings):.1f} ({len(ratings)} reviews)"
+
+def comparison_row(company_info: CompanyInfo) -> List[Optional[str]]:
+    similarweb = company_info.similarweb_data
+    employees = company_info.employee_count or (str(company_info.linkedin_data.employees) if company_info.linkedin_data.employees else None)
+    return [
+        company_info.company_name,
+        canonical_domain(company_info.website_url) if company_info.website_url else None,
+        company_info.industry,
+        employees,
+        str(company_info.founding_year) if company_info.founding_year else None,
+        company_info.estimated_revenue,
+        f"{similarweb.globalRank:,}" if similarweb.globalRank else None,
+        f"{similarweb.totalVisits:,}" if similarweb.totalVisits else None,
+        trustpilot_rating(company_info),
+    ]
+
+COMPARISON_COLUMNS = ["Company", "Website", "Industry", "Employees", "Founded", "Revenue", "Global rank", "Monthly visits", "Trustpilot rating"]
+
+def comparison_table(company_info: CompanyInfo, competitors: List[CompanyInfo]) -> str:
+    """Markdown table comparing the company with its researched competitors on their structured fields."""
+    def cell(value: Optional[str]) -> str:
+        return " ".join(str(value).split()).replace("|", "\\|") if value else "-"
+
+    lines = [
+        "| " + " | ".join(COMPARISON_COLUMNS) + " |",
+        "|" + "---|" * len(COMPARISON_COLUMNS),
+    ]
+    for index, company in enumerate([company_info, *competitors]):
+        row = [cell(value) for value in comparison_row(company)]
+        if index == 0:
+            row[0] = f"**{row[0]}**"
+        lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines)
+
+def add_comparison(report: str, company_info: CompanyInfo, competitors: List[CompanyInfo]) -> str:
+    """Append a competitor comparison section to the report."""
+    return (
+        report.rstrip() + "\n\n## Competitor Comparison\n\n"
+        f"{company_info.company_name} compared with the competitors researched in the same run.\n\n"
+        + comparison_table(company_info, competitors) + "\n"
+    )
@@ -1,197 +1,859 @@
 from apify import Actor
-from apify_client import ApifyClient
 import os
-import math
 import asyncio
 import json
-from dotenv import load_dotenv
-from pydantic_ai import Agent, Tool
-from pydantic_ai.settings import ModelSettings
-from pydantic_ai.models.gemini import GeminiModel
-from typing import Dict, Any
-from .models import CompanyInfo, BasicCompanyInfo, Deps
-from .prompts import RESEARCH_AGENT_SYSTEM_PROMPT, BUSINESS_REPORT_AGENT_SYSTEM_PROMPT
-from .tools import search_google, get_linkedin_company_profile, search_google_maps, get_trustpilot_reviews, get_similarweb_results
+import re
+import dataclasses
+import functools
+import hashlib
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from .batching import ScraperBatcher
+from .billing import ChargeLedger, charge_tokens, close_fallback_ledger, current_ledger
+from .competitors import add_comparison, company_keys, pick_competitors, researched_keys
+from .cache import CompletionCache, ScraperCache, SearchMemo, completion_key
+from .profiles import MEMORY_STRATEGIES, ResourceProfiles
+from .compaction import compact_company_data, prepare_company_data_for_report, to_compact_json, estimate_tokens
+from .models import CompanyInfo, BasicCompanyInfo, Deps, ResearchOptions
+from .speculation import SpeculativeEnricher
+from .pipeline import StageGraph
+from .refresh import DEFAULT_REFRESH_DAYS, SOURCE_FIELDS, CompanySnapshots, diff_companies, expired_sources, fetch_times, is_empty, is_material
+from .tracing import Tracer, current_tracer, span
+from .prefill import CompanySeed, missing_fields_model, parse_company_seed, prefill_company_fields
+from .prompts import RESEARCH_AGENT_SYSTEM_PROMPT, BUSINESS_REPORT_AGENT_SYSTEM_PROMPT, REPORT_SECTION_AGENT_SYSTEM_PROMPT
+from .sections import REPORT_SECTIONS, ReportSection, get_section_data, normalize_section, stitch_report
+from .tools import DEFAULT_SOURCE_TIMEOUT_SECS, search_company_news, get_linkedin_company_profile, search_google_maps, get_trustpilot_reviews, get_similarweb_results
 
-load_dotenv()
+if TYPE_CHECKING:
+    from apify_client import ApifyClientAsync
+    from pydantic_ai import Agent
 
-apify_api_key = os.getenv("APIFY_API_KEY")
-client = ApifyClient(apify_api_key)
+# The clients and the agents are built on first use, so that importing this module stays cheap for
+# the tests, the benchmark and the standby server, and a run only imports and builds what it uses.
+# The agents resolve their model when they first run, so tests and the benchmark can override it
+# without an API key.
+MODEL_NAME = "google-gla:gemini-2.0-flash"
 
-model = GeminiModel('gemini-2.0-flash', provider='google-gla')
+@functools.lru_cache(maxsize=None)
+def get_client() -> "ApifyClientAsync":
+    """The Apify client shared by every company of the run."""
+    from apify_client import ApifyClientAsync
+    from dotenv import load_dotenv
+    load_dotenv()
+    return ApifyClientAsync(os.getenv("APIFY_API_KEY"))
 
-research_agent = Agent(
-    model,
-    result_type=BasicCompanyInfo,
-    system_prompt = RESEARCH_AGENT_SYSTEM_PROMPT,
-    deps_type=Deps,
-    model_settings=ModelSettings(temperature=0),
-    tools=[
-        Tool(search_google, takes_ctx=True)
-    ],
-    end_strategy='early'
-)
+def new_agent(**kwargs: Any) -> "Agent":
+    from pydantic_ai import Agent
+    from dotenv import load_dotenv
+    # GEMINI_API_KEY may come from .env, it is read when the agent first runs
+    load_dotenv()
+    return Agent(MODEL_NAME, defer_model_check=True, **kwargs)
 
-business_report_agent = Agent(
-    model,
-    system_prompt=BUSINESS_REPORT_AGENT_SYSTEM_PROMPT,
-)
+@functools.lru_cache(maxsize=None)
+def get_research_agent() -> "Agent":
+    from pydantic_ai import Tool
+    from pydantic_ai.settings import ModelSettings
+    from .agent_tools import search_google, search_google_batch
+    return new_agent(
+        result_type=BasicCompanyInfo,
+        system_prompt = RESEARCH_AGENT_SYSTEM_PROMPT,
+        deps_type=Deps,
+        model_settings=ModelSettings(temperature=0),
+        tools=[
+            Tool(search_google, takes_ctx=True),
+            Tool(search_google_batch, takes_ctx=True),
+        ],
+        end_strategy='early'
+    )
 
-def prepare_company_data_for_report(company_info: CompanyInfo) -> Dict[str, Any]:
-    """Prepare a clean dictionary of company data for the report agent."""
-    data = company_info.model_dump()
+@functools.lru_cache(maxsize=None)
+def get_business_report_agent() -> "Agent":
+    return new_agent(system_prompt=BUSINESS_REPORT_AGENT_SYSTEM_PROMPT)
+
+@functools.lru_cache(maxsize=None)
+def get_report_section_agent() -> "Agent":
+    return new_agent(system_prompt=REPORT_SECTION_AGENT_SYSTEM_PROMPT)
+
+# Extra time a source gets after its budget to abort its run and read the partial dataset
+RUN_STOP_GRACE_SECS = 15
+
+# Time kept free before the platform timeout to generate the reports and push the results
+REPORT_RESERVE_SECS = 120
+
+def get_report_key(company_name: str, prefix: str = "report", extension: str = "md") -> str:
+    """Build a valid key-value store key for a company's report or other per-company record.
+
+    Names that only differ in characters replaced by the sanitizing, e.g. "Acme, Inc." and "Acme; Inc.",
+    keep their own keys thanks to a short hash of the name.
+    """
+    company_name = company_name.strip()
+    sanitized = re.sub(r"[^a-zA-Z0-9!\-_.'()]", "_", company_name)
+    digest = hashlib.sha256(company_name.encode("utf-8")).hexdigest()[:8]
+    return f"{prefix}_{sanitized[:200]}_{digest}.{extension}"
+
+def get_completion_key(agent: "Agent", system_prompt: str, prompt: str) -> str:
+    """Content address of an agent completion for the completion cache."""
+    # The agent holds the model name with its provider prefix until its first run resolves the model
+    model_name = getattr(agent.model, "model_name", None) or str(agent.model).split(":")[-1]
+    return completion_key(model_name, system_prompt, agent.model_settings, prompt)
+
+def get_usage_attrs(usage: Any) -> Dict[str, Any]:
+    """Token counts of an agent run as span attributes."""
+    return {
+        "requests": usage.requests,
+        "request_tokens": usage.request_tokens,
+        "response_tokens": usage.response_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+
+async def stream_business_report(report_prompt: str, options: ResearchOptions) -> Tuple[str, Any, Dict[str, float]]:
+    """Generate the report with the streaming API, flushing partial markdown to the KV store as it arrives.
+
+    Returns the full report, the usage of the completion and the timing metrics.
+    """
+    start = time.perf_counter()
+    metrics: Dict[str, float] = {}
+    default_store = await Actor.open_key_value_store()
+    report = ""
+    sections: List[str] = []
+    last_flush = start
     
-    # Convert nested models to dictionaries for better readability
-    if "linkedin_data" in data and data["linkedin_data"]:
-        data["linkedin_data"] = company_info.linkedin_data.model_dump()
+    with span("agent.report.stream") as attrs:
+        async with get_business_report_agent().run_stream(report_prompt) as stream:
+            async for report in stream.stream_text(debounce_by=0.2):
+                # Log every new top-level section as soon as its heading arrives
+                headings = re.findall(r"^##\s+(.+)$", report, flags=re.MULTILINE)
+                for heading in headings[len(sections):]:
+                    if not sections:
+                        metrics["report_time_to_first_section"] = round(time.perf_counter() - start, 3)
+                    sections.append(heading)
+                    Actor.log.info(f"Report section started: {heading.strip()}")
+            
+                if options.on_partial_report:
+                    await options.on_partial_report(report)
+                if time.perf_counter() - last_flush >= options.report_flush_secs:
+                    last_flush = time.perf_counter()
+                    try:
+                        with span("kv.set_value", key=options.report_key):
+                            await default_store.set_value(options.report_key, report, content_type="text/markdown")
+                    except Exception as e:
+                        Actor.log.warning(f"Failed to flush partial report: {str(e)}")
+            usage = stream.usage()
+        attrs.update(get_usage_attrs(usage))
+        attrs["time_to_first_section"] = metrics.get("report_time_to_first_section")
     
-    if "similarweb_data" in data and data["similarweb_data"]:
-        data["similarweb_data"] = company_info.similarweb_data.model_dump()
+    metrics["report_generation_time"] = round(time.perf_counter() - start, 3)
+    Actor.log.info(f"Report generated with {len(sections)} sections in {metrics['report_generation_time']}s")
+    return report, usage, metrics
+
+async def generate_report_sections(
+    company_name: str,
+    company_info: CompanyInfo,
+    options: ResearchOptions,
+    completions: Optional[CompletionCache] = None,
+) -> Tuple[str, int, Dict[str, float], List[str]]:
+    """Write the report sections concurrently, each from its own slice of the data, and stitch them in order.
+
+    Sections without any data are skipped, and sections whose data did not change come from the
+    completion cache. When streaming, the report is saved each time a section finishes.
+    Returns the report, empty when no section was written, the total tokens used, the timing metrics
+    and the titles of the sections that failed.
+    """
+    start = time.perf_counter()
+    metrics: Dict[str, float] = {}
+    data = compact_company_data(company_info)
+    planned = [(section, get_section_data(data, section, options.report_token_budget)) for section in REPORT_SECTIONS]
+    planned = [(section, section_data) for section, section_data in planned if section_data]
+    sections = [""] * len(planned)
+    default_store = await Actor.open_key_value_store() if options.stream_report else None
     
-    # Convert lists of models to lists of dictionaries
-    if "trustpilot_data" in data and data["trustpilot_data"]:
-        data["trustpilot_data"] = [review.model_dump() for review in company_info.trustpilot_data]
+    async def write_section(index: int, section: ReportSection, section_data: Dict[str, Any]) -> Tuple[int, str, int]:
+        prompt = (
+            f'Write the "{section.title}" section of the business report for {company_name}.\n'
+            f'{section.instructions}\n'
+            f'Start with the heading "## {section.title}". Use this data:\n\n'
+            f'```json\n{to_compact_json(section_data)}\n```'
+        )
+        key = get_completion_key(get_report_section_agent(), REPORT_SECTION_AGENT_SYSTEM_PROMPT, prompt)
+        cached = await completions.get(key) if completions else None
+        if cached:
+            metrics["report_cache_hits"] = metrics.get("report_cache_hits", 0) + 1
+            return index, cached["text"], 0
+        try:
+            with span("agent.report.section", section=section.title) as attrs:
+                result = await get_report_section_agent().run(prompt)
+                attrs.update(get_usage_attrs(result.usage()))
+        except Exception as e:
+            Actor.log.error(f"Failed to generate report section {section.title}: {str(e)}")
+            return index, "", 0
+        text = normalize_section(result.data, section.title)
+        if completions:
+            await completions.set(key, text, get_usage_attrs(result.usage()))
+        return index, text, result.usage().total_tokens or 0
     
-    if "google_maps_data" in data and data["google_maps_data"]:
-        data["google_maps_data"] = [place.model_dump() for place in company_info.google_maps_data]
+    total_tokens = 0
+    tasks = [asyncio.create_task(write_section(i, section, section_data)) for i, (section, section_data) in enumerate(planned)]
+    for next_section in asyncio.as_completed(tasks):
+        index, text, tokens = await next_section
+        sections[index] = text
+        total_tokens += tokens
+        if text and "report_time_to_first_section" not in metrics:
+            metrics["report_time_to_first_section"] = round(time.perf_counter() - start, 3)
+        if options.on_partial_report and text:
+            await options.on_partial_report(stitch_report(company_name, sections))
+        if default_store and text:
+            try:
+                with span("kv.set_value", key=options.report_key):
+                    await default_store.set_value(options.report_key, stitch_report(company_name, sections), content_type="text/markdown")
+            except Exception as e:
+                Actor.log.warning(f"Failed to flush partial report: {str(e)}")
     
-    if "key_employees" in data and data["key_employees"]:
-        data["key_employees"] = [employee.model_dump() for employee in company_info.key_employees]
+    metrics["report_generation_time"] = round(time.perf_counter() - start, 3)
+    failed = [section.title for (section, _), text in zip(planned, sections) if not text]
+    metrics["report_failed_sections"] = len(failed)
+    written = len(planned) - len(failed)
+    Actor.log.info(f"Report generated from {written}/{len(planned)} sections in {metrics['report_generation_time']}s")
+    return (stitch_report(company_name, sections) if written else ""), total_tokens, metrics, failed
+
+async def run_research_agent(company_name: str, deps: Deps, known: Optional[Dict[str, Any]] = None) -> CompanyInfo:
+    """Run the research agent and turn its BasicCompanyInfo result into a CompanyInfo.
+
+    With `known` fields from structured sources, the agent is only asked for the remaining fields.
+    """
+    known = known or {}
+    prompt = f'Research the company "{company_name}" and provide all required information'
+    if known:
+        prompt = (
+            f'Research the company "{company_name}". These fields are already known from LinkedIn and Similarweb:\n'
+            f'{to_compact_json(known)}\n'
+            'Only research and provide the remaining fields.'
+        )
     
-    if "latest_news" in data and data["latest_news"]:
-        data["latest_news"] = [news.model_dump() for news in company_info.latest_news]
+    with span("agent.research", prefilled_fields=len(known)) as attrs:
+        result = await get_research_agent().run(prompt, deps=deps, result_type=missing_fields_model(frozenset(known)) if known else BasicCompanyInfo)
+        attrs.update(get_usage_attrs(result.usage()))
     
-    return data
-
-async def main() -> None:
-    async with Actor:
-        actor_input = await Actor.get_input() 
-        company_name = actor_input.get("company_name")
-        
-        await Actor.charge('init', 1)
-        
-        result = await research_agent.run(f'Research the company "{company_name}" and provide all required information', deps=Deps(client=client))
-        
-        usage = result.usage()
-        await Actor.charge(event_name='1k-llm-tokens', count=math.ceil(usage.total_tokens / 1000))
+    usage = result.usage()
+    await charge_tokens(usage.total_tokens)
+    with span("parse.research"):
+        data = BasicCompanyInfo(**{**result.data.model_dump(), **known})
 
         # Create a CompanyInfo object from the BasicCompanyInfo result
         company_info = CompanyInfo(
-            company_name=result.data.company_name,
-            website_url=result.data.website_url,
-            short_description=result.data.short_description,
-            
-            # New fields
-            industry=result.data.industry,
-            business_model=result.data.business_model,
-            target_market=result.data.target_market,
-            products_services=result.data.products_services,
-            founding_year=result.data.founding_year,
-            funding_information=result.data.funding_information,
-            estimated_revenue=result.data.estimated_revenue,
-            key_employees=result.data.key_employees,
-            employee_count=result.data.employee_count,
-            competitors=result.data.competitors,
-            market_position=result.data.market_position,
-            
-            # Traditional fields
-            linkedin_url=result.data.linkedin_url,
-            twitter_url=result.data.twitter_url,
-            facebook_url=result.data.facebook_url,
-            instagram_url=result.data.instagram_url,
-            youtube_url=result.data.youtube_url,
-            
-            latest_news=result.data.latest_news,
-            extra_data=result.data.extra_data
-        )
-        
-        tasks = []
-        
-        if company_info.linkedin_url:
-            tasks.append(get_linkedin_company_profile(client, company_info.linkedin_url))
-        
-        if company_info.website_url:
-            tasks.append(get_trustpilot_reviews(client, company_info.website_url))
-            tasks.append(get_similarweb_results(client, company_info.website_url))
+            company_name=data.company_name,
+            website_url=data.website_url,
+            short_description=data.short_description,
         
-        if tasks:
-            results = await asyncio.gather(*tasks)
-            
-            # Assign results based on task index to avoid incorrect assignments
-            result_index = 0
-            
-            if company_info.linkedin_url:
-                company_info.linkedin_data = results[result_index]
-                result_index += 1
-            
-            if company_info.website_url:
-                company_info.trustpilot_data = results[result_index]
-                result_index += 1
-                company_info.similarweb_data = results[result_index]
-        
-            # Check if we have an address in linkedin_data or similarweb_data
-            address = None
-            if company_info.linkedin_data and company_info.linkedin_data.address:
-                address = company_info.linkedin_data.address
-            elif company_info.similarweb_data and company_info.similarweb_data.address:
-                address = company_info.similarweb_data.address
-                
-            if address:
-                # Include company name to improve search results
-                maps_query = f"{company_name} {address}"
-                company_info.google_maps_data = await search_google_maps(client, maps_query)
-        
-        # Generate the business report using the collected data
-        Actor.log.info("Generating comprehensive business report...")
-        company_data = prepare_company_data_for_report(company_info)
-        
-        report_prompt = f"""
-        Generate a comprehensive business report for {company_name}.
-        
-        Use all the following company data to inform your analysis:
-        
-        ```json
-        {json.dumps(company_data, indent=2, default=str)}
-        ```
-        
-        Create a flexible report that adapts to the available information. Focus on providing meaningful 
-        insights about the company based on the data collected. Use relevant business analysis frameworks 
-        that make sense for this company and the available information.
-        
-        The report should be well-structured in markdown format with clear headings and subheadings.
-        """
-        
-        report_result = await business_report_agent.run(report_prompt)
-        
-        usage = report_result.usage()
-        await Actor.charge(event_name='1k-llm-tokens', count=math.ceil(usage.total_tokens / 1000))
+            # New fields
+            industry=data.industry,
+            business_model=data.business_model,
+            target_market=data.target_market,
+            products_services=data.products_services,
+            founding_year=data.founding_year,
+            funding_information=data.funding_information,
+            estimated_revenue=data.estimated_revenue,
+            key_employees=data.key_employees,
+            employee_count=data.employee_count,
+            competitors=data.competitors,
+            market_position=data.market_position,
         
-        # Extract the report content safely
-        if isinstance(report_result.data, str):
-            company_info.report = report_result.data
-        elif hasattr(report_result.data, 'report'):
-            company_info.report = report_result.data.report
-        else:
-            # Try to get the report as a dictionary attribute
-            try:
-                report_data = getattr(report_result.data, 'model_dump', lambda: {})()
-                company_info.report = report_data.get('report', str(report_result.data))
-            except Exception as e:
-                Actor.log.warning(f"Could not extract report from result: {str(e)}")
-                company_info.report = str(report_result.data)
+            # Traditional fields
+            linkedin_url=data.linkedin_url,
+            twitter_url=data.twitter_url,
+            facebook_url=data.facebook_url,
+            instagram_url=data.instagram_url,
+            youtube_url=data.youtube_url,
         
-        # Save the report to KV store
+            latest_news=data.latest_news,
+            extra_data=data.extra_data
+        )
+    
+    return company_info
+
+async def generate_business_report(
+    company_name: str,
+    company_info: CompanyInfo,
+    options: ResearchOptions,
+    completions: Optional[CompletionCache] = None,
+) -> None:
+    """Generate the business report from the collected data and store it on company_info.
+
+    With a completion cache, an unchanged report prompt reuses the stored report without calling the LLM.
+    """
+    Actor.log.info("Generating comprehensive business report...")
+    if options.parallel_report_sections:
+        company_info.report, total_tokens, metrics, company_info.failed_report_sections = await generate_report_sections(company_name, company_info, options, completions)
+        company_info.run_metrics.update(metrics)
+        await charge_tokens(total_tokens)
+        if company_info.report:
+            return
+        # A report with only its title is no report, write it in one pass instead
+        Actor.log.warning(f"No report section of {company_name} was written, generating the whole report at once")
+    
+    company_data = prepare_company_data_for_report(company_info, options.report_token_budget)
+    Actor.log.info(f"Report payload for {company_name}: ~{estimate_tokens(company_data)} tokens (budget {options.report_token_budget})")
+    
+    report_prompt = f"""
+    Generate a comprehensive business report for {company_name}.
+    
+    Use all the following company data to inform your analysis:
+    
+    ```json
+    {to_compact_json(company_data)}
+    ```
+    
+    Create a flexible report that adapts to the available information. Focus on providing meaningful 
+    insights about the company based on the data collected. Use relevant business analysis frameworks 
+    that make sense for this company and the available information.
+    
+    The report should be well-structured in markdown format with clear headings and subheadings.
+    """
+    
+    key = get_completion_key(get_business_report_agent(), BUSINESS_REPORT_AGENT_SYSTEM_PROMPT, report_prompt)
+    cached = await completions.get(key) if completions else None
+    if cached:
+        Actor.log.info(f"Reusing the cached report for {company_name}, its data did not change")
+        company_info.report = cached["text"]
+        company_info.run_metrics["report_cache_hits"] = 1
+        return
+    
+    if options.stream_report:
+        company_info.report, usage, metrics = await stream_business_report(report_prompt, options)
+        company_info.run_metrics.update(metrics)
+        await charge_tokens(usage.total_tokens)
+        if completions and company_info.report:
+            await completions.set(key, company_info.report, get_usage_attrs(usage))
+        return
+    
+    report_start = time.perf_counter()
+    with span("agent.report") as attrs:
+        report_result = await get_business_report_agent().run(report_prompt)
+        attrs.update(get_usage_attrs(report_result.usage()))
+    company_info.run_metrics["report_generation_time"] = round(time.perf_counter() - report_start, 3)
+    
+    usage = report_result.usage()
+    await charge_tokens(usage.total_tokens)
+    
+    # Extract the report content safely
+    if isinstance(report_result.data, str):
+        company_info.report = report_result.data
+    elif hasattr(report_result.data, 'report'):
+        company_info.report = report_result.data.report
+    else:
+        # Try to get the report as a dictionary attribute
         try:
-            default_store = await Actor.open_key_value_store()
-            Actor.log.info("Saving business report to KV store...")
+            report_data = getattr(report_result.data, 'model_dump', lambda: {})()
+            company_info.report = report_data.get('report', str(report_result.data))
+        except Exception as e:
+            Actor.log.warning(f"Could not extract report from result: {str(e)}")
+            company_info.report = str(report_result.data)
+    
+    if completions and company_info.report:
+        await completions.set(key, company_info.report, get_usage_attrs(usage))
+
+def get_maps_address(results: Dict[str, Any]) -> Optional[str]:
+    """Return the first usable company address from the LinkedIn or Similarweb results collected so far."""
+    for source in ("linkedin", "similarweb"):
+        data = results.get(source)
+        # Similarweb joins missing address parts into strings like ", , "
+        if data is not None and data.address and data.address.strip(" ,"):
+            return data.address
+    return None
+
+async def run_within_budget(deps: Deps, source: str, awaitable: Awaitable[Any]) -> Any:
+    """Await the result of a source within its time budget, or record it as timed out and return None."""
+    budget = deps.time_budget(source)
+    if budget is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, budget + RUN_STOP_GRACE_SECS)
+    except asyncio.TimeoutError:
+        Actor.log.warning(f"{source} ran out of its {budget:.0f}s budget, continuing without it")
+        deps.timed_out_sources.add(source)
+        return None
+
+# CompanyInfo field that holds the data of each enrichment stage
+STAGE_DATA_FIELDS = {
+    "linkedin": "linkedin_data",
+    "trustpilot": "trustpilot_data",
+    "similarweb": "similarweb_data",
+    "maps": "google_maps_data",
+}
+
+async def research_company(company_name: str, deps: Deps, options: ResearchOptions) -> CompanyInfo:
+    """Research a single company, enrich it with external data and generate its business report.
+
+    A company given as a website or LinkedIn URL takes the fast path: LinkedIn and Similarweb run
+    first, the fields they cover are filled directly and the research agent only looks for the rest.
+    """
+    # Track search coverage per company while sharing clients and caches
+    deps = dataclasses.replace(deps, covered_fields=set(), timed_out_sources=set())
+    seed = parse_company_seed(company_name) if options.structured_fast_path else CompanySeed(company_name)
+    fast_path = seed.has_urls
+    
+    if options.speculative_enrichment and not fast_path:
+        deps.speculator = SpeculativeEnricher(company_name, {
+            "linkedin": lambda url: get_linkedin_company_profile(deps, url),
+            "trustpilot": lambda url: get_trustpilot_reviews(deps, url),
+            "similarweb": lambda url: get_similarweb_results(deps, url),
+        })
+    
+    def enrichment_stage(source: str, fn, get_target: Callable[[Dict[str, Any]], Optional[str]]):
+        async def run(results: Dict[str, Any]) -> Any:
+            target = get_target(results)
+            if not target:
+                return None
+            # Join a speculative run for the same target instead of starting a new one
+            task = deps.speculator.take(source, target) if deps.speculator else None
+            return await run_within_budget(deps, source, task or fn(deps, target))
+        return run
+    
+    def research_field(field: str) -> Callable[[Dict[str, Any]], Optional[str]]:
+        return lambda results: getattr(results["research"], field)
+    
+    def known_fields(results: Dict[str, Any]) -> Dict[str, Any]:
+        return prefill_company_fields(seed, results.get("linkedin"), results.get("similarweb"))
+    
+    def report_name(results: Dict[str, Any]) -> str:
+        # A URL given as input is replaced by the name the sources report
+        if not fast_path:
+            return company_name
+        if "research" in results:
+            return results["research"].company_name
+        return known_fields(results).get("company_name", company_name)
+    
+    async def research_stage(results: Dict[str, Any]) -> CompanyInfo:
+        known = {}
+        if fast_path:
+            known = known_fields(results)
+            # Search results only need to cover what the structured sources left open
+            deps.covered_fields.update(known)
+            Actor.log.info(f"Filled {len(known)} fields of {company_name} from structured sources: {', '.join(sorted(known))}")
+        company_info = await run_research_agent(report_name(results), deps, known)
+        company_info.run_metrics["prefilled_fields"] = len(known)
+        if deps.speculator:
+            # Keep only the speculative runs whose target matches the final URLs
+            deps.speculator.retain({
+                "linkedin": company_info.linkedin_url,
+                "trustpilot": company_info.website_url,
+                "similarweb": company_info.website_url,
+            })
+        return company_info
+    
+    async def maps_stage(results: Dict[str, Any]) -> Any:
+        address = get_maps_address(results)
+        if not address:
+            return None
+        # Include company name to improve search results
+        maps_query = f"{report_name(results)} {address}"
+        return await run_within_budget(deps, "google_maps", search_google_maps(deps, maps_query))
+    
+    async def report_stage(results: Dict[str, Any]) -> None:
+        company_info = results["research"]
+        for stage, data_field in STAGE_DATA_FIELDS.items():
+            if results.get(stage) is not None:
+                setattr(company_info, data_field, results[stage])
+        await generate_business_report(report_name(results), company_info, options, deps.completion_cache)
+    
+    graph = StageGraph()
+    if fast_path:
+        # Similarweb needs a website, from the input or from LinkedIn; LinkedIn without an input URL waits for the agent
+        graph.add("linkedin", enrichment_stage(
+            "linkedin", get_linkedin_company_profile,
+            lambda results: seed.linkedin_url or results["research"].linkedin_url,
+        ), after=[] if seed.linkedin_url else ["research"])
+        graph.add("similarweb", enrichment_stage(
+            "similarweb", get_similarweb_results,
+            lambda results: seed.website_url or (results["linkedin"].website if results.get("linkedin") else None),
+        ), after=[] if seed.website_url else ["linkedin"])
+        graph.add("research", research_stage, after=["similarweb"] + (["linkedin"] if seed.linkedin_url else []))
+        graph.add("trustpilot", enrichment_stage(
+            "trustpilot", get_trustpilot_reviews,
+            lambda results: seed.website_url or results["research"].website_url,
+        ), after=[] if seed.website_url else ["research"])
+    else:
+        graph.add("research", research_stage)
+        graph.add("linkedin", enrichment_stage("linkedin", get_linkedin_company_profile, research_field("linkedin_url")), after=["research"])
+        graph.add("trustpilot", enrichment_stage("trustpilot", get_trustpilot_reviews, research_field("website_url")), after=["research"])
+        graph.add("similarweb", enrichment_stage("similarweb", get_similarweb_results, research_field("website_url")), after=["research"])
+    # Maps only needs an address, so it starts from whichever of LinkedIn and Similarweb provides one first
+    graph.add("maps", maps_stage, after=["linkedin", "similarweb"], ready=lambda results: get_maps_address(results) is not None)
+    graph.add("report", report_stage, after=["research", "linkedin", "trustpilot", "similarweb", "maps"])
+    
+    try:
+        results = await graph.run()
+    finally:
+        if deps.speculator:
+            deps.speculator.cancel_unclaimed()
+    
+    company_info = results["research"]
+    company_info.timed_out_sources = sorted(deps.timed_out_sources)
+    company_info.run_metrics.update({f"{name}_time": timing["duration"] for name, timing in graph.timings.items()})
+    
+    tracer = current_tracer.get()
+    if tracer:
+        tracer.record_stages(graph.timings, graph.critical_path())
+    return company_info
+
+async def refresh_company(company_name: str, deps: Deps, options: ResearchOptions, snapshots: CompanySnapshots) -> Tuple[CompanyInfo, Dict[str, float]]:
+    """Refresh a company researched before, re-fetching only the sources older than their freshness.
+
+    The report is regenerated only when at least `refresh_min_changes` material changes were found,
+    otherwise the previous report is kept without calling the LLM. Companies without a snapshot, or
+    whose profile expired, are researched from scratch. Returns the company and the fetch time of each source.
+    """
+    snapshot = await snapshots.get(company_name)
+    refresh_days = {**DEFAULT_REFRESH_DAYS, **options.refresh_days}
+    expired = expired_sources(snapshot["fetched_at"], refresh_days) if snapshot else ["profile"]
+    if "profile" in expired or not snapshot["company"].report:
+        Actor.log.info(f"No fresh profile of {company_name}, researching it from scratch")
+        company_info = await research_company(company_name, deps, options)
+        return company_info, fetch_times(company_info)
+    
+    previous = snapshot["company"]
+    company_info = previous.model_copy(deep=True)
+    company_info.run_metrics, company_info.timed_out_sources, company_info.material_changes = {}, [], []
+    company_info.failed_report_sections = []
+    fetched_at = dict(snapshot["fetched_at"])
+    # A cache entry older than the refresh window would be recorded as freshly fetched
+    max_age_days = {("search" if source == "news" else source): days for source, days in refresh_days.items() if source in expired}
+    deps = dataclasses.replace(deps, covered_fields=set(), timed_out_sources=set(), cache_max_age_days=max_age_days)
+    name = previous.company_name or company_name
+    
+    def refresh_stage(source: str, fetch: Callable[[Dict[str, Any]], Optional[Awaitable[Any]]]):
+        async def run(results: Dict[str, Any]) -> Any:
+            awaitable = fetch(results)
+            if awaitable is None:
+                return None
+            data = await run_within_budget(deps, "search" if source == "news" else source, awaitable)
+            # A failed or timed out fetch keeps the previous data and is retried on the next refresh
+            if data is None or is_empty(data if isinstance(data, list) else data.model_dump(exclude_defaults=True)):
+                Actor.log.warning(f"No fresh {source} data for {name}, keeping the previous data")
+                return None
+            setattr(company_info, SOURCE_FIELDS[source], data)
+            fetched_at[source] = time.time()
+            return data
+        return run
+    
+    def maps_fetch(results: Dict[str, Any]) -> Optional[Awaitable[Any]]:
+        address = get_maps_address({"linkedin": company_info.linkedin_data, "similarweb": company_info.similarweb_data})
+        return search_google_maps(deps, f"{name} {address}") if address else None
+    
+    fetchers = {
+        "news": lambda results: search_company_news(deps, name),
+        "linkedin": lambda results: get_linkedin_company_profile(deps, company_info.linkedin_url) if company_info.linkedin_url else None,
+        "similarweb": lambda results: get_similarweb_results(deps, company_info.website_url) if company_info.website_url else None,
+        "trustpilot": lambda results: get_trustpilot_reviews(deps, company_info.website_url) if company_info.website_url else None,
+    }
+    graph = StageGraph()
+    for source, fetch in fetchers.items():
+        if source in expired:
+            graph.add(source, refresh_stage(source, fetch))
+    if "google_maps" in expired:
+        # The address may come from LinkedIn or Similarweb data refreshed in the same run
+        graph.add("google_maps", refresh_stage("google_maps", maps_fetch), after=[source for source in ("linkedin", "similarweb") if source in graph.stages])
+    
+    Actor.log.info(f"Refreshing {name}: {', '.join(graph.stages) or 'all sources are fresh'}")
+    results = await graph.run()
+    refreshed = [source for source, data in results.items() if data is not None]
+    
+    changes = [change for change in diff_companies(previous, company_info) if is_material(change)]
+    company_info.material_changes = [change.describe() for change in changes]
+    if changes and len(changes) >= options.refresh_min_changes:
+        Actor.log.info(f"{len(changes)} material changes for {name}, regenerating the report")
+        await generate_business_report(name, company_info, options, deps.completion_cache)
+    else:
+        Actor.log.info(f"{len(changes)} material changes for {name}, keeping the previous report")
+    
+    company_info.timed_out_sources = sorted(deps.timed_out_sources)
+    company_info.run_metrics.update({f"{source}_time": timing["duration"] for source, timing in graph.timings.items()})
+    company_info.run_metrics.update({"refreshed_sources": len(refreshed), "material_changes": len(changes)})
+    
+    tracer = current_tracer.get()
+    if tracer:
+        tracer.record_stages(graph.timings, graph.critical_path())
+    return company_info, fetched_at
+
+async def save_company_result(company_info: CompanyInfo, options: ResearchOptions) -> None:
+    """Store the report in the KV store and push the company data to the dataset."""
+    default_store = await Actor.open_key_value_store()
+    
+    # Save the report to KV store
+    try:
+        Actor.log.info(f"Saving business report to KV store under {options.report_key}...")
+        with span("kv.set_value", key=options.report_key):
             await default_store.set_value(
-                "report.md", 
+                options.report_key, 
                 company_info.report,
                 content_type="text/markdown"
             )
-            Actor.log.info("Business report saved successfully")
+        Actor.log.info("Business report saved successfully")
+    except Exception as e:
+        Actor.log.error(f"Failed to save business report to KV store: {str(e)}")
+    
+    # Push complete data including the report to the default dataset
+    with span("dataset.push_data"):
+        await Actor.push_data(company_info.model_dump())
+    
+    # Save the latency trace last so that it covers the writes above
+    tracer = current_tracer.get()
+    if tracer and options.trace_key:
+        try:
+            await default_store.set_value(options.trace_key, tracer.to_dict())
         except Exception as e:
-            Actor.log.error(f"Failed to save business report to KV store: {str(e)}")
+            Actor.log.warning(f"Failed to save trace to KV store: {str(e)}")
+
+def get_company_names(actor_input: Dict[str, Any]) -> List[str]:
+    """Accept a single company name, a list of companies, or both, without duplicates."""
+    company_names = []
+    if actor_input.get("company_name"):
+        company_names.append(actor_input["company_name"])
+    company_names.extend(actor_input.get("companies") or [])
+    return list(dict.fromkeys(name.strip() for name in company_names if name and name.strip()))
+
+async def main() -> None:
+    async with Actor:
+        actor_input = await Actor.get_input() or {}
         
-        # Push complete data including the report to the default dataset
-        await Actor.push_data(company_info.model_dump())
+        # Standby runs serve research requests over HTTP until the platform stops them
+        if Actor.config.meta_origin == "STANDBY":
+            from .standby import serve
+            await serve(actor_input, get_client())
+            return
+        
+        company_names = get_company_names(actor_input)
+        if not company_names:
+            Actor.log.error("No company to research. Provide `company_name` or `companies` in the input.")
+            return
+        
+        try:
+            await research_companies(company_names, actor_input, get_client())
+        finally:
+            await close_fallback_ledger()
+
+def get_deadline(deadline_secs: Optional[float]) -> Optional[float]:
+    """Monotonic time by which enrichment has to finish: the requested deadline, or early enough before the platform timeout to still report."""
+    deadlines = []
+    if deadline_secs:
+        deadlines.append(time.monotonic() + deadline_secs)
+    timeout_at = Actor.config.timeout_at
+    if timeout_at:
+        remaining = (timeout_at - datetime.now(timezone.utc)).total_seconds()
+        deadlines.append(time.monotonic() + remaining - REPORT_RESERVE_SECS)
+    return min(deadlines) if deadlines else None
+
+@dataclasses.dataclass
+class SharedResources:
+    """Caches and run stats that outlive a single research call: one Actor run, or every request of a standby server."""
+    cache: Optional[ScraperCache]
+    profiles: ResourceProfiles
+    completion_cache: Optional[CompletionCache]
+    snapshots: CompanySnapshots
+    memory_strategy: str = "fixed"
+    ledger: Optional[ChargeLedger] = None
+
+async def load_shared_resources(actor_input: Dict[str, Any], memory_entries: int = 0) -> SharedResources:
+    """Open the caches configured by the input and load the state earlier runs left in them.
+
+    `memory_entries` keeps that many recently used records of each cache in memory as well.
+    """
+    store_name = actor_input.get("cache_store_name", "company-researcher-cache")
+    local_dir = None if Actor.is_at_home() else actor_input.get("cache_dir", ".cache/scrapers")
+    
+    # Cache parsed scraper results across runs in a named KV store, or a local directory when offline
+    cache = None
+    if actor_input.get("use_cache", True):
+        cache = ScraperCache(
+            store_name=store_name, local_dir=local_dir, ttl_days=actor_input.get("cache_ttl_days"), memory_entries=memory_entries,
+        )
+    
+    # Record the stats of every child run, and pick its memory from them unless the strategy is fixed
+    memory_strategy = actor_input.get("memory_strategy", "fixed")
+    profiles = ResourceProfiles(latency_weight=MEMORY_STRATEGIES.get(memory_strategy), store_name=store_name, local_dir=local_dir)
+    await profiles.load()
+    
+    # Reuse report completions whose prompt did not change since an earlier run
+    completion_cache = None
+    if actor_input.get("cache_completions", True):
+        completion_cache = CompletionCache(
+            store_name=store_name, local_dir=local_dir, max_entries=actor_input.get("completion_cache_size", 500),
+            memory_entries=memory_entries,
+        )
+    
+    # Last data of every company and when each source was fetched, the baseline of refresh mode
+    snapshots = CompanySnapshots(store_name=store_name, local_dir=local_dir, memory_entries=memory_entries)
+    
+    # Collect pay-per-event charges and send them in batches instead of one API call per event
+    ledger = ChargeLedger(flush_secs=actor_input.get("billing_flush_secs", 10), flush_events=actor_input.get("billing_flush_events", 100))
+    await ledger.start()
+    return SharedResources(cache, profiles, completion_cache, snapshots, memory_strategy, ledger)
+
+async def save_shared_resources(shared: SharedResources) -> None:
+    """Persist the run stats and cache indexes for later runs, store the cache stats of this run and send the pending charges."""
+    Actor.log.info(f"Resource profiles ({shared.memory_strategy}): {json.dumps(shared.profiles.stats)}")
+    await shared.profiles.save()
+    
+    default_store = await Actor.open_key_value_store()
+    if shared.completion_cache:
+        await shared.completion_cache.save()
+        Actor.log.info(f"Completion cache stats: {json.dumps(shared.completion_cache.stats)}")
+        await default_store.set_value("completion_cache_stats", shared.completion_cache.stats)
+    
+    if shared.cache:
+        Actor.log.info(f"Scraper cache stats: {json.dumps(shared.cache.stats)}")
+        await default_store.set_value("cache_stats", shared.cache.stats)
+    
+    if shared.ledger:
+        await shared.ledger.flush()
+
+async def research_companies(
+    company_names: List[str],
+    actor_input: Dict[str, Any],
+    client: "ApifyClientAsync",
+    shared: Optional[SharedResources] = None,
+    on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+    request_id: Optional[str] = None,
+) -> List[CompanyInfo]:
+    """Research the companies concurrently and save each result as soon as it is ready.
+
+    Without `shared` resources the caches are loaded from the input and saved at the end, and the
+    `init` event of the run is charged through their ledger. `on_event`
+    receives a "report" event with the partial markdown while a streamed report is generated, and a
+    "result" event with each saved company. With a `request_id`, e.g. of a standby request, the reports
+    and traces are saved under keys of that request. Returns the companies researched, competitors included.
+    """
+    owns_shared = shared is None
+    if shared is None:
+        shared = await load_shared_resources(actor_input)
+    # Every charge of the companies and their competitors goes through the ledger of the shared resources
+    ledger_token = current_ledger.set(shared.ledger)
+    if owns_shared and shared.ledger:
+        # A run charges its start like a standby request, so that the billing summary includes it
+        shared.ledger.add('init', 1)
+    cache, profiles, completion_cache, snapshots = shared.cache, shared.profiles, shared.completion_cache, shared.snapshots
+    
+    # Coalesce LinkedIn, Similarweb and Google Maps targets of concurrent companies into shared actor runs
+    batcher = None
+    competitor_count = max(0, actor_input.get("competitor_count", 0))
+    if (len(company_names) > 1 or competitor_count) and actor_input.get("batch_scrapers", True):
+        batcher = ScraperBatcher(
+            client,
+            window_secs=actor_input.get("batch_window_secs", 2),
+            max_batch_size=actor_input.get("max_batch_size", 10),
+            profiles=profiles,
+        )
+    
+    # Reuse results of equivalent search queries within the run, and across runs when caching is on
+    search_memo = SearchMemo(cache if actor_input.get("cache_search_results", True) else None)
+    
+    deps = Deps(
+        client=client,
+        cache=cache,
+        batcher=batcher,
+        search_memo=search_memo,
+        search_char_budget=actor_input.get("search_result_char_budget", 4000),
+        source_timeout_secs={**DEFAULT_SOURCE_TIMEOUT_SECS, **(actor_input.get("source_timeout_secs") or {})},
+        deadline=get_deadline(actor_input.get("deadline_secs")),
+        profiles=profiles,
+        completion_cache=completion_cache,
+    )
+    max_concurrency = max(1, actor_input.get("max_concurrency", 3))
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    results: List[CompanyInfo] = []
+    
+    # Every company of the run under its name, domain and LinkedIn keys, resolved once it is researched
+    researched: Dict[str, asyncio.Future] = {}
+    competitor_tasks: List[asyncio.Task] = []
+    
+    def register(keys: Iterable[str], future: asyncio.Future) -> None:
+        for key in keys:
+            researched.setdefault(key, future)
+    
+    async def research_competitors(company_name: str, company_info: CompanyInfo) -> List[CompanyInfo]:
+        """Research the top competitors of a company in the shared pool, reusing companies already in the run."""
+        futures = []
+        for name in pick_competitors(company_info, competitor_count, skip=researched_keys(company_name, company_info)):
+            future = next((researched[key] for key in company_keys(name) if key in researched), None)
+            if future is None:
+                Actor.log.info(f"Researching {name} as a competitor of {company_name}")
+                future = asyncio.get_running_loop().create_future()
+                register(company_keys(name), future)
+                competitor_tasks.append(asyncio.create_task(process_company(name, competitor_of=company_name, future=future)))
+            futures.append(future)
+        return [competitor for competitor in await asyncio.gather(*futures) if competitor is not None]
+    
+    async def process_company(company_name: str, competitor_of: Optional[str] = None, future: Optional[asyncio.Future] = None) -> None:
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            register(company_keys(company_name), future)
+        # Keep the historical report.md key for single company runs, requests sharing a run get their own keys
+        single = len(company_names) == 1 and competitor_of is None and request_id is None
+        key_suffix = f"_{request_id}" if request_id else ""
+        options = ResearchOptions(
+            report_key="report.md" if single else get_report_key(company_name, f"report{key_suffix}"),
+            trace_key="trace.json" if single else get_report_key(company_name, f"trace{key_suffix}", "json"),
+            report_token_budget=actor_input.get("report_token_budget", 20000),
+            stream_report=actor_input.get("stream_report", False),
+            report_flush_secs=actor_input.get("report_flush_secs", 5),
+            speculative_enrichment=actor_input.get("speculative_enrichment", False),
+            structured_fast_path=actor_input.get("structured_fast_path", False),
+            parallel_report_sections=actor_input.get("parallel_report_sections", False),
+            refresh_mode=actor_input.get("refresh_mode", False),
+            refresh_days=actor_input.get("refresh_days") or {},
+            refresh_min_changes=actor_input.get("refresh_min_changes", 3),
+            on_partial_report=(lambda markdown: on_event("report", {"company": company_name, "markdown": markdown})) if on_event else None,
+        )
+        company_info = None
+        try:
+            async with semaphore:
+                # Competitors start from the context of their company, so they always replace its tracer
+                current_tracer.set(Tracer() if actor_input.get("save_trace", True) else None)
+                try:
+                    if options.refresh_mode:
+                        company_info, fetched_at = await refresh_company(company_name, deps, options, snapshots)
+                    else:
+                        company_info = await research_company(company_name, deps, options)
+                        fetched_at = fetch_times(company_info)
+                except Exception as e:
+                    Actor.log.error(f"Failed to research company {company_name}: {str(e)}")
+                    return
+                company_info.competitor_of = competitor_of
+                register(researched_keys(company_name, company_info), future)
+                await snapshots.set(company_name, company_info, fetched_at)
+        finally:
+            # Companies waiting for this one as a competitor only need its data, not its saved result
+            if not future.done():
+                future.set_result(company_info)
+        
+        # Fan out outside the pool slot, the competitors need it
+        if competitor_count and competitor_of is None:
+            competitors = await research_competitors(company_name, company_info)
+            if competitors and company_info.report:
+                company_info.report = add_comparison(company_info.report, company_info, competitors)
+        # Push each company as soon as it finishes so slow ones don't hold back the rest
+        await save_company_result(company_info, options)
+        results.append(company_info)
+        if on_event:
+            await on_event("result", company_info.model_dump(mode="json"))
+    
+    Actor.log.info(f"Researching {len(company_names)} companies with concurrency {max_concurrency}")
+    try:
+        await asyncio.gather(*[process_company(name) for name in company_names])
+        # Every competitor was started before the company it belongs to finished
+        await asyncio.gather(*competitor_tasks)
+    finally:
+        current_ledger.reset(ledger_token)
+        # Send the charges of the run even when it fails, a standby server closes its ledger on shutdown
+        if owns_shared and shared.ledger:
+            await shared.ledger.close()
+    if competitor_tasks:
+        Actor.log.info(f"Researched {len(competitor_tasks)} competitors next to {len(company_names)} companies")
+    
+    Actor.log.info(f"Search memo stats: {json.dumps(search_memo.stats)}")
+    if batcher:
+        Actor.log.info(f"Scraper batching stats: {json.dumps(batcher.stats)}")
+    if owns_shared:
+        await save_shared_resources(shared)
+    return results
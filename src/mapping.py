@@ -0,0 +1,250 @@
+from apify import Actor
+from typing import Annotated, Any, Callable, Dict, List, Optional, Tuple, Type, Union
+from typing_extensions import TypedDict
+from dataclasses import dataclass, field
+from pydantic import AliasPath, BaseModel, BeforeValidator, Field, TypeAdapter, ValidationError
+from .models import (
+    LinkedInData, TrustpilotReview, GoogleMapsPlace, GoogleMapsReview, SimilarwebData, AdsSource, TopReferral,
+    SocialNetwork, TopCountry, Competitor, TopKeyword, TrafficSourcesData,
+)
+
+Path = Union[str, Tuple[Union[str, int], ...]]
+
+@dataclass
+class FieldMap:
+    """How to fill one model field from a raw dataset item.
+
+    `path` is the source key, or a tuple of keys and list indexes for nested values; it defaults to
+    the field name. `coerce` converts the raw value before validation. `compute` builds the value
+    from the whole item instead. `nested` maps a nested object and `items` a list of nested
+    objects with their own mapping.
+    """
+    path: Optional[Path] = None
+    coerce: Optional[Callable[[Any], Any]] = None
+    compute: Optional[Callable[[Dict[str, Any]], Any]] = None
+    nested: Optional["SourceMapping"] = None
+    items: Optional["SourceMapping"] = None
+
+@dataclass
+class SourceMapping:
+    """Declarative mapping of raw dataset items to a model.
+
+    Fields of the model that are not listed are read from the key of the same name. `item_filter`
+    drops raw items, e.g. reviews without text, before they are validated.
+    """
+    model: Type[BaseModel]
+    fields: Dict[str, Union[Path, FieldMap]] = field(default_factory=dict)
+    item_filter: Optional[Callable[[Dict[str, Any]], bool]] = None
+    _raw_type: Any = field(default=None, init=False, repr=False)
+    _adapters: Optional[Dict[str, TypeAdapter]] = field(default=None, init=False, repr=False)
+
+    @property
+    def raw_type(self) -> Any:
+        """TypedDict that reads the model's fields from a raw item, compiled on first use."""
+        if self._raw_type is None:
+            self._raw_type = compile_mapping(self)
+        return self._raw_type
+
+    @property
+    def adapters(self) -> Dict[str, TypeAdapter]:
+        if self._adapters is None:
+            self._adapters = {
+                "raw": TypeAdapter(self.raw_type),
+                "raw_list": TypeAdapter(List[self.raw_type]),
+                "model_list": TypeAdapter(List[self.model]),
+            }
+        return self._adapters
+
+    def keep(self, items: Any) -> List[Dict[str, Any]]:
+        """Drop non-dict items and the items rejected by the filter."""
+        if not isinstance(items, list):
+            return []
+        return [item for item in items if isinstance(item, dict) and (self.item_filter is None or self.item_filter(item))]
+
+    def validate_one(self, item: Dict[str, Any]) -> BaseModel:
+        return self.model.model_validate(self.adapters["raw"].validate_python(item))
+
+    def validate_many(self, items: List[Dict[str, Any]]) -> List[BaseModel]:
+        """Validate a whole list of raw items in one call per stage, skipping items that fail validation.
+
+        Each stage only reports its own invalid items, so they are dropped until both stages pass.
+        """
+        items = self.keep(items)
+        count = len(items)
+        while True:
+            try:
+                models = self._validate_list(items)
+                break
+            except ValidationError as e:
+                invalid = {error["loc"][0] for error in e.errors() if error["loc"] and isinstance(error["loc"][0], int)}
+                if not invalid:
+                    # Errors that don't point at items leave no choice but to validate them one by one
+                    models = self._validate_each(items)
+                    break
+                items = [item for i, item in enumerate(items) if i not in invalid]
+        if len(models) < count:
+            Actor.log.warning(f"Skipping {count - len(models)} invalid {self.model.__name__} items")
+        return models
+
+    def _validate_each(self, items: List[Dict[str, Any]]) -> List[BaseModel]:
+        models = []
+        for item in items:
+            try:
+                models.append(self.validate_one(item))
+            except ValidationError:
+                continue
+        return models
+
+    def _validate_list(self, items: List[Dict[str, Any]]) -> List[BaseModel]:
+        return self.adapters["model_list"].validate_python(self.adapters["raw_list"].validate_python(items))
+
+def to_alias(path: Path) -> Union[str, AliasPath]:
+    if isinstance(path, tuple):
+        return AliasPath(*path)
+    return path
+
+def compile_mapping(mapping: SourceMapping) -> Any:
+    """Build a TypedDict that renames, coerces and filters a raw item into the model's field names.
+
+    Paths become pydantic validation aliases and coercions become validators, so a whole list of
+    items is reshaped by pydantic-core and then validated against the model without a Python loop
+    per field.
+    """
+    fields: Dict[str, Any] = {}
+    computed: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+    for name in mapping.model.model_fields:
+        spec = mapping.fields.get(name, FieldMap())
+        spec = spec if isinstance(spec, FieldMap) else FieldMap(path=spec)
+        # Values are validated against the model itself in the second stage
+        annotation: Any = Any
+        validators = []
+
+        if spec.nested is not None:
+            annotation = spec.nested.raw_type
+            validators.append(BeforeValidator(lambda value: value if isinstance(value, dict) else {}))
+        if spec.items is not None:
+            annotation = List[spec.items.raw_type]
+            validators.append(BeforeValidator(spec.items.keep))
+        if spec.coerce is not None:
+            validators.append(BeforeValidator(spec.coerce))
+
+        if spec.compute is not None:
+            computed[name] = spec.compute
+        elif spec.path is not None:
+            validators.append(Field(validation_alias=to_alias(spec.path)))
+        fields[name] = Annotated[tuple([annotation, *validators])] if validators else annotation
+
+    raw_type: Any = TypedDict(f"Raw{mapping.model.__name__}", fields, total=False)
+    if computed:
+        def add_computed_fields(item: Any) -> Any:
+            if isinstance(item, dict):
+                item = {**item, **{name: compute(item) for name, compute in computed.items()}}
+            return item
+        raw_type = Annotated[raw_type, BeforeValidator(add_computed_fields)]
+    return raw_type
+
+# Coercions shared by the mappings
+def to_float(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def to_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def to_str(value: Any) -> str:
+    return "" if value is None else str(value)
+
+def pluck(key: str) -> Callable[[Any], List[Any]]:
+    """Coercion turning a list of objects into the list of their `key` values; plain strings are kept."""
+    def coerce(values: Any) -> List[Any]:
+        plucked = []
+        for value in values if isinstance(values, list) else []:
+            if isinstance(value, dict) and value.get(key):
+                plucked.append(value[key])
+            elif isinstance(value, str):
+                plucked.append(value)
+        return plucked
+    return coerce
+
+def to_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else []
+
+def join_address(address: Any) -> Any:
+    """Join a schema.org PostalAddress object into a single line."""
+    if not isinstance(address, dict):
+        return address
+    parts = ["streetAddress", "addressLocality", "addressRegion", "postalCode", "addressCountry"]
+    return ", ".join(str(address[part]) for part in parts if address.get(part))
+
+def seconds_to_duration(value: Any) -> Any:
+    """Similarweb reports the average visit duration in seconds, keep it as an "00:mm:ss" string."""
+    if isinstance(value, int):
+        return f"00:{value // 60:02d}:{value % 60:02d}"
+    return value
+
+AGE_GROUP_FIELDS = {(18, 24): "age18_24", (25, 34): "age25_34", (35, 44): "age35_44", (45, 54): "age45_54", (55, 64): "age55_64"}
+
+def age_distribution_from_groups(groups: Any) -> Dict[str, Any]:
+    """Similarweb returns age groups as a list; keep the list and fill the flat per-bucket fields."""
+    if isinstance(groups, dict):
+        return groups
+    if not isinstance(groups, list):
+        return {}
+    groups = [g for g in groups if isinstance(g, dict)]
+    data: Dict[str, Any] = {"groups": groups}
+    for group in groups:
+        if group.get("minAge") == 65:
+            data["age65_plus"] = group.get("value")
+        elif (group.get("minAge"), group.get("maxAge")) in AGE_GROUP_FIELDS:
+            data[AGE_GROUP_FIELDS[(group.get("minAge"), group.get("maxAge"))]] = group.get("value")
+    return data
+
+def similarweb_address(item: Dict[str, Any]) -> str:
+    return f"{item.get('companyHeadquarterCity') or ''}, {item.get('companyHeadquarterStateCode') or ''}, {item.get('companyHeadquarterCountryCode') or ''}"
+
+def has(key: str) -> Callable[[Dict[str, Any]], bool]:
+    return lambda item: bool(item.get(key))
+
+# One mapping per source, new sources only need another table
+LINKEDIN_MAPPING = SourceMapping(LinkedInData, {
+    "employees": "numberOfEmployees",
+    "specialties": FieldMap(coerce=pluck("value")),
+    "address": FieldMap(coerce=join_address),
+})
+
+TRUSTPILOT_MAPPING = SourceMapping(TrustpilotReview)
+
+GOOGLE_MAPS_MAPPING = SourceMapping(GoogleMapsPlace, {
+    # Only keep reviews that have text
+    "categories": FieldMap(coerce=to_list),
+    "reviews": FieldMap(items=SourceMapping(GoogleMapsReview, item_filter=has("text"))),
+})
+
+SIMILARWEB_MAPPING = SourceMapping(SimilarwebData, {
+    "avgVisitDuration": FieldMap(coerce=seconds_to_duration),
+    "organicTraffic": FieldMap(coerce=to_float),
+    "paidTraffic": FieldMap(coerce=to_float),
+    "trafficSources": FieldMap(nested=SourceMapping(TrafficSourcesData, {
+        "direct": "directVisitsShare",
+        "referrals": "referralVisitsShare",
+        "search": "organicSearchVisitsShare",
+        "social": "socialNetworksVisitsShare",
+        "mail": "mailVisitsShare",
+        "paid": "paidSearchVisitsShare",
+    })),
+    "adsSources": FieldMap(items=SourceMapping(AdsSource, {"domain": FieldMap(coerce=to_str), "visitsShare": FieldMap(coerce=to_float)}, item_filter=has("domain"))),
+    "topReferrals": FieldMap(items=SourceMapping(TopReferral, {"domain": FieldMap(coerce=to_str), "visitsShare": FieldMap(coerce=to_float)}, item_filter=has("domain"))),
+    "socialNetworkDistribution": FieldMap(items=SourceMapping(SocialNetwork, {"name": FieldMap(coerce=to_str), "visitsShare": FieldMap(coerce=to_float)})),
+    "topCountries": FieldMap(items=SourceMapping(TopCountry, {"country": FieldMap("countryAlpha2Code", coerce=to_str), "share": FieldMap("visitsShare", coerce=to_float)})),
+    "topSimilarityCompetitors": FieldMap(items=SourceMapping(Competitor, {"domain": FieldMap(coerce=to_str), "visitsTotalCount": FieldMap(coerce=to_int)}, item_filter=has("domain"))),
+    "topKeywords": FieldMap(items=SourceMapping(TopKeyword, {"name": FieldMap(coerce=to_str), "estimatedSearches": FieldMap("volume", coerce=to_int), "cpc": FieldMap(coerce=to_float)}, item_filter=has("name"))),
+    "topInterestedWebsites": FieldMap(coerce=pluck("domain")),
+    "ageDistribution": FieldMap(coerce=age_distribution_from_groups),
+    "address": FieldMap(compute=similarweb_address),
+})
@@ -1,12 +1,66 @@
-from typing import List, Optional, Dict, Any
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
 from pydantic import BaseModel, Field
-from dataclasses import dataclass
-from apify_client import ApifyClient
+from dataclasses import dataclass, field
+import time
+from apify_client import ApifyClientAsync
+from .cache import CompletionCache, ScraperCache, SearchMemo
+from .batching import ScraperBatcher
+from .profiles import ResourceProfiles
+from .speculation import SpeculativeEnricher
 
 
 @dataclass  
 class Deps:
-    client: ApifyClient
+    client: ApifyClientAsync
+    cache: Optional[ScraperCache] = None
+    batcher: Optional[ScraperBatcher] = None
+    search_memo: Optional[SearchMemo] = None
+    # Maximum characters kept per search result page, 0 keeps whole pages
+    search_char_budget: int = 4000
+    # BasicCompanyInfo fields already covered by earlier search results of the current company
+    covered_fields: Set[str] = field(default_factory=set)
+    # Starts enrichment scrapers from URLs seen in search results of the current company
+    speculator: Optional[SpeculativeEnricher] = None
+    # Time budget per source in seconds, sources without one are only bound by the deadline
+    source_timeout_secs: Dict[str, float] = field(default_factory=dict)
+    # time.monotonic() by which the enrichment of every company has to be done
+    deadline: Optional[float] = None
+    # Sources of the current company that ran out of time and returned partial or no data
+    timed_out_sources: Set[str] = field(default_factory=set)
+    # Run stats per actor and input size used to pick the memory of child runs
+    profiles: Optional[ResourceProfiles] = None
+    # Maximum age in days of cache entries served per source, below their TTL, e.g. the refresh window
+    cache_max_age_days: Dict[str, float] = field(default_factory=dict)
+    # Report completions of earlier runs keyed by their prompt
+    completion_cache: Optional[CompletionCache] = None
+
+    def time_budget(self, source: str) -> Optional[float]:
+        """Seconds the source may still take, capped by the run deadline."""
+        budget = self.source_timeout_secs.get(source)
+        if self.deadline is not None:
+            remaining = max(0.0, self.deadline - time.monotonic())
+            budget = remaining if budget is None else min(budget, remaining)
+        return budget
+
+@dataclass
+class ResearchOptions:
+    """Per-run settings of the research pipeline taken from the Actor input."""
+    report_key: str = "report.md"
+    trace_key: str = "trace.json"
+    report_token_budget: int = 20000
+    stream_report: bool = False
+    report_flush_secs: float = 5.0
+    speculative_enrichment: bool = False
+    # Companies given as a website or LinkedIn URL start from the structured sources
+    structured_fast_path: bool = False
+    # Write the report sections concurrently from per-section data slices
+    parallel_report_sections: bool = False
+    # Re-fetch only stale sources of companies researched before and keep their report unless the data changed materially
+    refresh_mode: bool = False
+    refresh_days: Dict[str, float] = field(default_factory=dict)
+    refresh_min_changes: int = 3
+    # Receives the partial markdown while a streamed report is generated, e.g. to stream it over HTTP
+    on_partial_report: Optional[Callable[[str], Awaitable[None]]] = None
 
 # Define Pydantic models for structured output
 class Employee(BaseModel):
@@ -193,6 +247,13 @@ class CompanyInfo(BaseModel):
     
     # Business report field
     report: Optional[str] = Field(None, description="Comprehensive business report in markdown format")
+    
+    # Run metrics
+    run_metrics: Dict[str, float] = Field(default_factory=dict, description="Timing metrics of the run in seconds")
+    timed_out_sources: List[str] = Field(default_factory=list, description="Data sources that ran out of time and returned partial or no data")
+    material_changes: List[str] = Field(default_factory=list, description="Material changes since the previous run in refresh mode")
+    failed_report_sections: List[str] = Field(default_factory=list, description="Report sections that failed to generate and are missing from the report")
+    competitor_of: Optional[str] = Field(None, description="Company this one was researched for as a competitor")
 
 class BasicCompanyInfo(BaseModel):
     """Basic company information model without external API data fields.
@@ -0,0 +1,91 @@
+from apify import Actor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from dataclasses import dataclass, field
+import asyncio
+import time
+
+@dataclass
+class Stage:
+    """A pipeline step that runs once its dependencies resolve.
+
+    By default a stage waits for all stages in `after`. With `ready`, it starts as soon as
+    `ready(results)` is true for the results collected so far, or once all of `after` are done.
+    """
+    name: str
+    fn: Callable[[Dict[str, Any]], Awaitable[Any]]
+    after: List[str] = field(default_factory=list)
+    ready: Optional[Callable[[Dict[str, Any]], bool]] = None
+
+class StageGraph:
+    """Minimal DAG executor that starts every stage the moment its inputs are available."""
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[[Dict[str, Any]], Awaitable[Any]],
+        after: Iterable[str] = (),
+        ready: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> None:
+        """Register a stage. `fn` receives the results of the stages finished so far."""
+        self.stages[name] = Stage(name, fn, list(after), ready)
+
+    def _can_start(self, stage: Stage) -> bool:
+        if all(dep in self.results for dep in stage.after):
+            return True
+        return stage.ready is not None and stage.ready(self.results)
+
+    async def run(self) -> Dict[str, Any]:
+        """Run all stages and return their results by name."""
+        unknown = {dep for stage in self.stages.values() for dep in stage.after} - self.stages.keys()
+        if unknown:
+            raise ValueError(f"Unknown stage dependencies: {sorted(unknown)}")
+
+        start = time.perf_counter()
+        pending = dict(self.stages)
+        running: Dict[asyncio.Task, str] = {}
+
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if self._can_start(stage):
+                        del pending[name]
+                        self.timings[name] = {"start": round(time.perf_counter() - start, 3)}
+                        running[asyncio.create_task(stage.fn(self.results))] = name
+
+                if not running:
+                    raise RuntimeError(f"Stages can never start: {sorted(pending)}")
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    self.results[name] = task.result()
+                    timing = self.timings[name]
+                    timing["end"] = round(time.perf_counter() - start, 3)
+                    timing["duration"] = round(timing["end"] - timing["start"], 3)
+                    Actor.log.debug(f"Stage {name} finished in {timing['duration']}s")
+        finally:
+            for task in running:
+                task.cancel()
+
+        return self.results
+
+    def critical_path(self) -> List[str]:
+        """Walk back from the last finished stage through the dependency that finished last before it started."""
+        finished = {name: timing for name, timing in self.timings.items() if "end" in timing}
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda name: finished[name]["end"])]
+        while True:
+            stage = self.stages[path[-1]]
+            start = finished[path[-1]]["start"]
+            gating = [dep for dep in stage.after if dep in finished and finished[dep]["end"] <= start + 0.001]
+            if not gating:
+                break
+            path.append(max(gating, key=lambda name: finished[name]["end"]))
+        return list(reversed(path))
@@ -0,0 +1,74 @@
+from typing import Any, Dict, FrozenSet, Optional, Type
+from dataclasses import dataclass
+from pydantic import BaseModel, create_model
+from .models import BasicCompanyInfo, LinkedInData, SimilarwebData
+import functools
+import re
+
+@dataclass
+class CompanySeed:
+    """A company to research: a name, or a website or LinkedIn URL that structured scrapers can start from."""
+    name: str
+    website_url: str = ""
+    linkedin_url: str = ""
+
+    @property
+    def has_urls(self) -> bool:
+        return bool(self.website_url or self.linkedin_url)
+
+DOMAIN_PATTERN = re.compile(r"^(https?://)?([a-z0-9-]+\.)+[a-z]{2,}(/\S*)?$", re.IGNORECASE)
+
+def parse_company_seed(text: str) -> CompanySeed:
+    """Recognize a LinkedIn company URL or a website domain, anything else is a company name."""
+    text = text.strip()
+    if re.search(r"linkedin\.com/company/[^/?#\s]+", text, re.IGNORECASE):
+        url = text if text.lower().startswith(("http://", "https://")) else f"https://{text}"
+        return CompanySeed(name=text, linkedin_url=url)
+    if DOMAIN_PATTERN.match(text):
+        url = text if text.lower().startswith(("http://", "https://")) else f"https://{text}"
+        return CompanySeed(name=text, website_url=url)
+    return CompanySeed(name=text)
+
+def format_category(category: str) -> str:
+    """Turn a Similarweb category ID like "computers_electronics_and_technology/programming_and_developer_software" into "Programming and developer software"."""
+    return category.rsplit("/", 1)[-1].replace("_", " ").strip().capitalize()
+
+def prefill_company_fields(
+    seed: CompanySeed,
+    linkedin: Optional[LinkedInData] = None,
+    similarweb: Optional[SimilarwebData] = None,
+) -> Dict[str, Any]:
+    """Map LinkedIn and Similarweb data straight onto BasicCompanyInfo fields, leaving out what they don't cover.
+
+    The company name only comes from LinkedIn or a name given as the seed, Similarweb names are domains.
+    """
+    linkedin = linkedin or LinkedInData()
+    similarweb = similarweb or SimilarwebData()
+    fields: Dict[str, Any] = {
+        "company_name": linkedin.name or (None if seed.has_urls else seed.name),
+        "website_url": seed.website_url or linkedin.website,
+        "linkedin_url": seed.linkedin_url,
+        "short_description": linkedin.description or similarweb.description,
+        "industry": linkedin.industry or (format_category(similarweb.categoryId) if similarweb.categoryId else None),
+        "founding_year": similarweb.companyYearFounded,
+        "competitors": [competitor.domain for competitor in similarweb.topSimilarityCompetitors if competitor.domain],
+    }
+
+    if linkedin.employees:
+        fields["employee_count"] = str(linkedin.employees)
+    elif similarweb.companyEmployeesMin or similarweb.companyEmployeesMax:
+        fields["employee_count"] = f"{similarweb.companyEmployeesMin or 0}-{similarweb.companyEmployeesMax or ''}".rstrip("-")
+    if similarweb.companyAnnualRevenueMin:
+        fields["estimated_revenue"] = f"At least ${similarweb.companyAnnualRevenueMin:,} per year (Similarweb estimate)"
+
+    return {name: value for name, value in fields.items() if value}
+
+@functools.lru_cache(maxsize=None)
+def missing_fields_model(known: FrozenSet[str]) -> Type[BaseModel]:
+    """Result type for the research agent with only the BasicCompanyInfo fields that are not known yet."""
+    fields = {
+        name: (field.annotation, field)
+        for name, field in BasicCompanyInfo.model_fields.items()
+        if name not in known
+    }
+    return create_model("MissingCompanyInfo", __doc__="Company information still missing after the structured sources.", **fields)
@@ -0,0 +1,164 @@
+from apify import Actor
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import math
+import os
+import statistics
+
+# Memory sizes the platform accepts for a run, in megabytes
+MEMORY_OPTIONS_MBYTES = [128, 256, 512, 1024, 2048, 4096, 8192]
+
+# Weight of latency against cost in the memory objective, per strategy
+MEMORY_STRATEGIES = {"latency": 0.9, "balanced": 0.5, "cost": 0.1}
+
+# Input fields that multiply the amount of work of a run
+SIZE_KEYS = ("count", "maxResults", "maxCrawledPlaces", "maxReviews")
+
+# Finished runs kept per actor, input size and memory
+MAX_SAMPLES = 20
+
+PROFILES_KEY = "resource_profiles"
+
+def estimate_input_size(run_input: Dict[str, Any]) -> int:
+    """Number of targets in the input times its result limits, e.g. 3 websites x 100 reviews = 300."""
+    targets = max([len(v) for v in run_input.values() if isinstance(v, list)] + [1])
+    size = targets
+    for key in SIZE_KEYS:
+        if isinstance(run_input.get(key), int) and run_input[key] > 0:
+            size *= run_input[key]
+    return size
+
+def size_bucket(size: int) -> int:
+    """Round an input size up to a power of two so that similar inputs share a profile."""
+    return 1 << max(0, math.ceil(math.log2(max(1, size))))
+
+class ResourceProfiles:
+    """Observed duration and compute units of child actor runs per actor, input size and memory.
+
+    With a latency weight, `choose()` picks the memory that minimizes
+    `weight * duration / fastest + (1 - weight) * compute_units / cheapest` over the observed
+    memory sizes, and tries the next size in the direction the objective favours once.
+    Without one, it keeps the default memory and only records.
+    """
+
+    def __init__(
+        self,
+        latency_weight: Optional[float] = None,
+        store_name: str = "company-researcher-cache",
+        local_dir: Optional[str] = None,
+    ):
+        self.latency_weight = latency_weight
+        self.store_name = store_name
+        self.local_dir = local_dir
+        # "<actor>:<size bucket>" -> memory -> {"runs": [[duration, compute_units], ...], "failures": n}
+        self.samples: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def _key(self, actor_id: str, run_input: Dict[str, Any]) -> str:
+        return f"{actor_id}:{size_bucket(estimate_input_size(run_input))}"
+
+    def choose(self, actor_id: str, run_input: Dict[str, Any], default: int) -> int:
+        """Pick the memory for the next run of the actor with this input."""
+        if self.latency_weight is None:
+            return default
+
+        observed = {
+            int(memory): (
+                statistics.median(run[0] for run in sample["runs"]),
+                statistics.median(run[1] for run in sample["runs"]),
+            )
+            for memory, sample in self.samples.get(self._key(actor_id, run_input), {}).items()
+            # Memory sizes that mostly fail or time out are not candidates
+            if sample["runs"] and sample.get("failures", 0) <= len(sample["runs"])
+        }
+        if not observed:
+            return default
+
+        fastest = min(duration for duration, _ in observed.values()) or 1e-9
+        cheapest = min(units for _, units in observed.values()) or 1e-9
+        weight = self.latency_weight
+
+        def score(memory: int) -> float:
+            duration, units = observed[memory]
+            return weight * duration / fastest + (1 - weight) * units / cheapest
+
+        best = min(observed, key=score)
+        explore = best * 2 if weight >= 0.5 else best // 2
+        failed = self.samples[self._key(actor_id, run_input)].get(str(explore), {}).get("failures", 0)
+        if explore in MEMORY_OPTIONS_MBYTES and explore not in observed and not failed:
+            Actor.log.info(f"Trying {explore} MB for {actor_id}, best so far is {best} MB")
+            return explore
+        return best
+
+    def record(self, actor_id: str, run_input: Dict[str, Any], memory_mbytes: int, run: Optional[Dict[str, Any]]) -> None:
+        """Record the outcome of a finished run.
+
+        Failed runs, e.g. out of memory, count against their memory size. Runs that timed out or
+        were aborted are skipped since their duration depends on the time budget, not the memory.
+        """
+        status = (run or {}).get("status")
+        if status not in ("SUCCEEDED", "FAILED"):
+            return
+        sample = self.samples.setdefault(self._key(actor_id, run_input), {}).setdefault(
+            str(memory_mbytes), {"runs": [], "failures": 0}
+        )
+        stats = run.get("stats") or {}
+        duration = stats.get("runTimeSecs")
+        if status == "FAILED" or duration is None:
+            sample["failures"] += 1
+            return
+
+        units = stats.get("computeUnits")
+        if units is None:
+            # One compute unit is 1 GB of memory for one hour
+            units = memory_mbytes / 1024 * duration / 3600
+        sample["runs"] = (sample["runs"] + [[duration, units]])[-MAX_SAMPLES:]
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Median duration and run count per actor, input size and memory."""
+        return {
+            key: {
+                memory: {
+                    "runs": len(sample["runs"]),
+                    "failures": sample["failures"],
+                    "median_duration": round(statistics.median(run[0] for run in sample["runs"]), 2) if sample["runs"] else None,
+                }
+                for memory, sample in memories.items()
+            }
+            for key, memories in self.samples.items()
+        }
+
+    async def load(self) -> None:
+        """Load the profiles recorded by previous runs."""
+        try:
+            if self.local_dir:
+                path = os.path.join(self.local_dir, f"{PROFILES_KEY}.json")
+                if os.path.exists(path):
+                    def read_file() -> Dict[str, Any]:
+                        with open(path, encoding="utf-8") as f:
+                            return json.load(f)
+                    self.samples = await asyncio.to_thread(read_file)
+            else:
+                store = await Actor.open_key_value_store(name=self.store_name)
+                self.samples = await store.get_value(PROFILES_KEY) or {}
+        except Exception as e:
+            Actor.log.warning(f"Failed to load resource profiles: {str(e)}")
+
+    async def save(self) -> None:
+        """Persist the profiles for future runs."""
+        try:
+            if self.local_dir:
+                path = os.path.join(self.local_dir, f"{PROFILES_KEY}.json")
+
+                def write_file() -> None:
+                    os.makedirs(self.local_dir, exist_ok=True)
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(self.samples, f)
+
+                await asyncio.to_thread(write_file)
+            else:
+                store = await Actor.open_key_value_store(name=self.store_name)
+                await store.set_value(PROFILES_KEY, self.samples)
+        except Exception as e:
+            Actor.log.warning(f"Failed to save resource profiles: {str(e)}")
@@ -0,0 +1,126 @@
+from typing import Iterable, List, Set, Tuple
+from datetime import datetime
+import math
+import re
+
+# Keywords that indicate a page chunk carries information for a BasicCompanyInfo field
+FIELD_KEYWORDS = {
+    "website_url": {"website", "homepage", "www"},
+    "short_description": {"about", "mission", "platform", "provides", "helps"},
+    "industry": {"industry", "sector", "market"},
+    "business_model": {"pricing", "subscription", "revenue", "model", "plans", "customers"},
+    "target_market": {"customers", "clients", "audience", "enterprises", "developers", "businesses"},
+    "products_services": {"product", "products", "services", "features", "solutions", "platform"},
+    "founding_year": {"founded", "established", "since", "launched", "inception"},
+    "funding_information": {"funding", "raised", "series", "seed", "investors", "valuation", "round"},
+    "estimated_revenue": {"revenue", "arr", "sales", "turnover", "million", "billion"},
+    "key_employees": {"ceo", "cto", "cfo", "coo", "founder", "cofounder", "president", "head"},
+    "employee_count": {"employees", "staff", "team", "headcount", "people"},
+    "competitors": {"competitors", "alternatives", "versus", "vs", "rivals", "compared"},
+    "market_position": {"leader", "leading", "largest", "share", "ranked", "position"},
+    "linkedin_url": {"linkedin"},
+    "twitter_url": {"twitter"},
+    "facebook_url": {"facebook"},
+    "instagram_url": {"instagram"},
+    "youtube_url": {"youtube"},
+    "github_url": {"github"},
+    "discord_url": {"discord"},
+    "latest_news": {"announced", "announces", "news", "press", "today"},
+}
+
+def get_field_keywords(field: str) -> Set[str]:
+    """Keywords of a field, with the current and previous year for the latest news."""
+    keywords = FIELD_KEYWORDS.get(field, set())
+    if field == "latest_news":
+        year = datetime.now().year
+        keywords = keywords | {str(year), str(year - 1)}
+    return keywords
+
+# Lines matching these patterns are navigation, consent or footer boilerplate
+BOILERPLATE_PATTERNS = re.compile(
+    r"cookie|privacy policy|terms of (use|service)|all rights reserved|©|subscribe to|sign up|sign in|log in|"
+    r"accept all|skip to (main )?content|toggle navigation|back to top",
+    re.IGNORECASE,
+)
+
+MARKDOWN_LINK = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def is_boilerplate_line(line: str) -> bool:
+    """Detect link-only navigation lines, image-only lines and consent or footer text."""
+    stripped = line.strip(" \t-*|#>")
+    if not stripped:
+        return False
+    links = MARKDOWN_LINK.findall(stripped)
+    text_without_links = MARKDOWN_LINK.sub("", stripped).strip(" \t-*|·•/")
+    if links and len(text_without_links) < 20:
+        return True
+    return len(stripped) < 200 and bool(BOILERPLATE_PATTERNS.search(stripped))
+
+def strip_boilerplate(markdown: str) -> str:
+    """Remove boilerplate lines and collapse the blank lines they leave behind."""
+    lines = [line for line in markdown.splitlines() if not is_boilerplate_line(line)]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def split_into_chunks(text: str, target_chars: int = 600) -> List[str]:
+    """Split text on headings and blank lines and merge small paragraphs up to about target_chars."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n|\n(?=#)", text) if p.strip()]
+    chunks: List[str] = []
+    current = ""
+    for paragraph in paragraphs:
+        if current and (len(current) + len(paragraph) > target_chars or paragraph.startswith("#")):
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+def score_chunk(chunk: str, query_terms: Set[str], field_terms: Set[str]) -> float:
+    """Score a chunk by its query and missing-field term hits, dampened by its length."""
+    tokens = tokenize(chunk)
+    if not tokens:
+        return 0.0
+    hits = sum(2 for t in tokens if t in query_terms) + sum(1 for t in tokens if t in field_terms)
+    return hits / math.sqrt(len(tokens))
+
+def covered_fields(text: str) -> Set[str]:
+    """Return the fields whose keywords appear in the text."""
+    tokens = set(tokenize(text))
+    return {field for field in FIELD_KEYWORDS if tokens & get_field_keywords(field)}
+
+def prune_page(
+    markdown: str,
+    query: str,
+    missing_fields: Iterable[str],
+    char_budget: int,
+) -> Tuple[str, Set[str]]:
+    """Keep the most relevant chunks of a page within char_budget, in their original order.
+
+    Returns the pruned text and the fields its kept chunks appear to cover.
+    """
+    text = strip_boilerplate(markdown)
+    if len(text) <= char_budget:
+        return text, covered_fields(text)
+
+    query_terms = set(tokenize(query))
+    field_terms = set().union(*[get_field_keywords(field) for field in missing_fields])
+    chunks = split_into_chunks(text)
+    scores = [score_chunk(chunk, query_terms, field_terms) for chunk in chunks]
+    # The opening of a page usually summarizes it
+    if scores:
+        scores[0] += 0.5
+
+    kept: List[int] = []
+    used = 0
+    for index in sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True):
+        if scores[index] <= 0 or used + len(chunks[index]) > char_budget:
+            continue
+        kept.append(index)
+        used += len(chunks[index])
+
+    # Fall back to the start of the page when no chunk fits or matches
+    pruned = "\n\n".join(chunks[i] for i in sorted(kept)) or text[:char_budget]
+    return pruned, covered_fields(pruned)
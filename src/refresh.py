@@ -0,0 +1,149 @@
+from apify import Actor
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+import hashlib
+import time
+from .cache import StoreBackedCache
+from .models import CompanyInfo
+
+# How many days the data of each source stays fresh in refresh mode
+DEFAULT_REFRESH_DAYS = {
+    "profile": 30,
+    "news": 1,
+    "linkedin": 30,
+    "similarweb": 30,
+    "trustpilot": 7,
+    "google_maps": 7,
+}
+
+# CompanyInfo field refreshed by each source, the profile is everything the research agent fills
+SOURCE_FIELDS = {
+    "news": "latest_news",
+    "linkedin": "linkedin_data",
+    "similarweb": "similarweb_data",
+    "trustpilot": "trustpilot_data",
+    "google_maps": "google_maps_data",
+}
+
+# Fields that describe the run rather than the company
+RUN_FIELDS = {"report", "run_metrics", "timed_out_sources", "material_changes", "failed_report_sections", "competitor_of"}
+
+# Keys that identify an item of a list across refreshes, in order of preference
+IDENTITY_KEYS = ("url", "reviewUrl", "domain", "placeId", "country", "name", "title")
+
+# Relative change below which a number is considered noise, e.g. 2.31 -> 2.35 pages per visit
+MATERIAL_NUMERIC_CHANGE = 0.1
+
+@dataclass
+class Change:
+    """A difference between two versions of the company data at a dotted path."""
+    path: str
+    old: Any
+    new: Any
+
+    def describe(self) -> str:
+        def short(value: Any) -> str:
+            text = "none" if value is None else str(value)
+            return text if len(text) <= 60 else f"{text[:57]}..."
+        if self.old is None:
+            return f"{self.path}: added {short(self.new)}"
+        if self.new is None:
+            return f"{self.path}: removed {short(self.old)}"
+        return f"{self.path}: {short(self.old)} -> {short(self.new)}"
+
+def list_identity(items: List[Any]) -> Optional[str]:
+    """The first identity key present in every item of a list of objects."""
+    if not items or not all(isinstance(item, dict) for item in items):
+        return None
+    for key in IDENTITY_KEYS:
+        if all(item.get(key) for item in items):
+            return key
+    return None
+
+def diff_values(old: Any, new: Any, path: str = "") -> List[Change]:
+    """Structural diff of two dumped models.
+
+    Objects are compared key by key, lists of objects by their identity key so that reordered or
+    prepended items are not reported as changes, and lists of plain values as sets.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(old.keys() | new.keys()):
+            changes.extend(diff_values(old.get(key), new.get(key), f"{path}.{key}" if path else key))
+        return changes
+
+    if isinstance(old, list) and isinstance(new, list):
+        identity = list_identity(old + new)
+        if identity:
+            old_items = {item[identity]: item for item in old}
+            new_items = {item[identity]: item for item in new}
+            changes = []
+            for key in list(old_items) + [key for key in new_items if key not in old_items]:
+                changes.extend(diff_values(old_items.get(key), new_items.get(key), f"{path}[{key}]"))
+            return changes
+        if all(not isinstance(item, (dict, list)) for item in old + new):
+            old_set, new_set = set(map(str, old)), set(map(str, new))
+            return [Change(f"{path}[{item}]", None, item) for item in sorted(new_set - old_set)] + \
+                [Change(f"{path}[{item}]", item, None) for item in sorted(old_set - new_set)]
+        changes = []
+        for i in range(max(len(old), len(new))):
+            changes.extend(diff_values(old[i] if i < len(old) else None, new[i] if i < len(new) else None, f"{path}[{i}]"))
+        return changes
+
+    if old != new and not (is_empty(old) and is_empty(new)):
+        return [Change(path, old, new)]
+    return []
+
+def is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+def diff_companies(old: CompanyInfo, new: CompanyInfo) -> List[Change]:
+    return diff_values(old.model_dump(exclude=RUN_FIELDS), new.model_dump(exclude=RUN_FIELDS))
+
+def is_material(change: Change) -> bool:
+    """Numbers must move by at least MATERIAL_NUMERIC_CHANGE, any other change counts."""
+    old, new = change.old, change.new
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)) and not isinstance(old, bool):
+        base = max(abs(old), abs(new))
+        return base > 0 and abs(new - old) / base >= MATERIAL_NUMERIC_CHANGE
+    return True
+
+def snapshot_key(company_name: str) -> str:
+    digest = hashlib.sha256(" ".join(company_name.lower().split()).encode("utf-8")).hexdigest()[:32]
+    return f"company_{digest}"
+
+class CompanySnapshots(StoreBackedCache):
+    """The last CompanyInfo of every company and when each of its sources was fetched."""
+
+    async def get(self, company_name: str) -> Optional[Dict[str, Any]]:
+        """Return `{"company": CompanyInfo, "fetched_at": {source: timestamp}}`, or None without a valid snapshot."""
+        try:
+            entry = await self._read(snapshot_key(company_name))
+            if not entry:
+                return None
+            return {"company": CompanyInfo.model_validate(entry["company"]), "fetched_at": entry.get("fetched_at", {})}
+        except Exception as e:
+            Actor.log.warning(f"Ignoring the previous snapshot of {company_name}: {str(e)}")
+            return None
+
+    async def set(self, company_name: str, company_info: CompanyInfo, fetched_at: Dict[str, float]) -> None:
+        try:
+            await self._write(snapshot_key(company_name), {
+                "company": company_info.model_dump(mode="json"),
+                "fetched_at": fetched_at,
+            })
+        except Exception as e:
+            Actor.log.warning(f"Failed to save the snapshot of {company_name}: {str(e)}")
+
+def expired_sources(fetched_at: Dict[str, float], refresh_days: Dict[str, float], now: Optional[float] = None) -> List[str]:
+    """Sources whose data is older than their freshness, or was never fetched."""
+    now = time.time() if now is None else now
+    return [
+        source for source, days in refresh_days.items()
+        if now - fetched_at.get(source, 0) > days * 24 * 3600
+    ]
+
+def fetch_times(company_info: CompanyInfo, now: Optional[float] = None) -> Dict[str, float]:
+    """Fetch time of every source after a full research; sources that timed out are retried on the next refresh."""
+    now = time.time() if now is None else now
+    return {source: 0 if source in company_info.timed_out_sources else now for source in DEFAULT_REFRESH_DAYS}
@@ -0,0 +1,115 @@
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+import copy
+import re
+from .compaction import fit_to_token_budget, prune_empty
+
+@dataclass
+class ReportSection:
+    """One section of a section-wise report and the slice of the company data it is written from.
+
+    `fields` are top-level keys of the compact company data, or dotted paths such as
+    "similarweb_data.topCountries" for a single nested value.
+    """
+    title: str
+    instructions: str
+    fields: List[str] = field(default_factory=list)
+
+# Fields every section gets to know which company it writes about
+IDENTITY_FIELDS = ["company_name", "website_url", "industry"]
+
+SOCIAL_FIELDS = ["linkedin_url", "twitter_url", "facebook_url", "instagram_url", "youtube_url", "github_url", "discord_url"]
+
+REPORT_SECTIONS = [
+    ReportSection(
+        "Company Overview",
+        "Summarize the business focus, products and services, business model and target markets.",
+        ["short_description", "business_model", "target_market", "products_services", "founding_year", "extra_data",
+         "linkedin_data.description", "linkedin_data.specialties", "linkedin_data.address"],
+    ),
+    ReportSection(
+        "Funding and Financials",
+        "Cover the funding history, investors, revenue estimates and company size.",
+        ["funding_information", "estimated_revenue", "founding_year", "employee_count", "linkedin_data.employees",
+         "similarweb_data.companyAnnualRevenueMin", "similarweb_data.companyEmployeesMin", "similarweb_data.companyEmployeesMax"],
+    ),
+    ReportSection(
+        "Leadership and Organization",
+        "Describe the key people, their roles, and the size and structure of the team.",
+        ["key_employees", "employee_count", "linkedin_data.employees", "linkedin_data.address"],
+    ),
+    ReportSection(
+        "Competitive Landscape",
+        "Analyze the main competitors and the company's market position, with a comparison table where useful.",
+        ["competitors", "market_position", "similarweb_data.topSimilarityCompetitors", "similarweb_data.globalRank"],
+    ),
+    ReportSection(
+        "Digital Presence",
+        "Evaluate website traffic, traffic sources, audience and social media presence.",
+        ["similarweb_data", *SOCIAL_FIELDS],
+    ),
+    ReportSection(
+        "Customer Sentiment",
+        "Analyze customer reviews and ratings: recurring praise, complaints and the overall sentiment.",
+        ["trustpilot_data", "google_maps_data"],
+    ),
+    ReportSection(
+        "Recent News and Developments",
+        "Summarize the latest news and what it means for the company.",
+        ["latest_news"],
+    ),
+    ReportSection(
+        "Strategic Analysis",
+        "Apply a SWOT analysis, a PESTLE analysis and Porter's Five Forces to the company.",
+        ["short_description", "business_model", "target_market", "products_services", "funding_information",
+         "estimated_revenue", "employee_count", "competitors", "market_position"],
+    ),
+]
+
+def get_path(data: Dict[str, Any], path: str) -> Any:
+    value: Any = data
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def slice_company_data(data: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Copy only the given fields of the compact company data, keeping their nesting."""
+    sliced: Dict[str, Any] = {}
+    for path in fields:
+        value = get_path(data, path)
+        if value is None:
+            continue
+        *parents, last = path.split(".")
+        node = sliced
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[last] = copy.deepcopy(value)
+    return prune_empty(sliced)
+
+def get_section_data(data: Dict[str, Any], section: ReportSection, token_budget: int) -> Optional[Dict[str, Any]]:
+    """The slice of the data a section is written from, or None when none of its fields has data."""
+    sliced = slice_company_data(data, section.fields)
+    if not sliced:
+        return None
+    sliced.update(slice_company_data(data, IDENTITY_FIELDS))
+    return fit_to_token_budget(sliced, token_budget)
+
+def normalize_section(markdown: str, title: str) -> str:
+    """Make a generated section start with its `## title` heading and nest every other heading below it."""
+    lines = markdown.strip().splitlines()
+    # Drop a report title the model may have added despite the instructions
+    while lines and (not lines[0].strip() or re.match(r"^#\s", lines[0])):
+        lines.pop(0)
+    if not lines or not re.match(r"^##\s", lines[0]):
+        lines.insert(0, "")
+        lines.insert(0, f"## {title}")
+    else:
+        lines[0] = f"## {title}"
+    body = [re.sub(r"^#{1,2}\s", "### ", line) for line in lines[1:]]
+    return "\n".join([lines[0], *body]).strip()
+
+def stitch_report(company_name: str, sections: List[str]) -> str:
+    """Join the sections in their fixed order under a single report title."""
+    return f"# Business Report for {company_name}\n\n" + "\n\n".join(section for section in sections if section) + "\n"
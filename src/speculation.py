@@ -0,0 +1,85 @@
+from apify import Actor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import re
+from .cache import canonical_domain, canonical_linkedin_url, QUERY_STOPWORDS
+
+URL_PATTERN = re.compile(r"https?://[^\s)\]>\"']+")
+LINKEDIN_COMPANY_PATTERN = re.compile(r"https?://(?:[a-z]{2,3}\.)?linkedin\.com/company/[^\s/)\]>\"'?#]+", re.IGNORECASE)
+
+def compact_name(name: str) -> str:
+    """Lowercase a company name and drop legal suffixes and non-alphanumerics, e.g. "Apify Technologies s.r.o." -> "apifytechnologiessro"."""
+    tokens = re.findall(r"[a-z0-9]+", name.lower())
+    return "".join(token for token in tokens if token not in QUERY_STOPWORDS)
+
+class SpeculativeEnricher:
+    """Starts enrichment scrapers as soon as confident URLs show up in research tool results.
+
+    Launchers are `fn(target) -> awaitable` per source. Once the research agent is done, matching
+    tasks are claimed with `take()` and the rest are cancelled with `cancel_unclaimed()`.
+    """
+
+    def __init__(self, company_name: str, launchers: Dict[str, Callable[[str], Awaitable[Any]]]):
+        self.company_name = compact_name(company_name)
+        self.launchers = launchers
+        self.tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.claimed = 0
+
+    def is_confident_website(self, url: str) -> bool:
+        """A website is confident when its main domain label equals the compact company name."""
+        label = canonical_domain(url).split(".")[0].replace("-", "")
+        return bool(self.company_name) and label == self.company_name
+
+    def is_confident_linkedin(self, url: str) -> bool:
+        """A LinkedIn company page is confident when its slug contains the compact company name."""
+        slug = canonical_linkedin_url(url).rsplit("/", 1)[-1].replace("-", "")
+        return bool(self.company_name) and self.company_name in slug
+
+    def observe(self, results: List[str]) -> None:
+        """Scan tool results for the company website and LinkedIn page and start their scrapers."""
+        for text in results:
+            for url in LINKEDIN_COMPANY_PATTERN.findall(text):
+                if self.is_confident_linkedin(url):
+                    self._start("linkedin", url)
+            match = re.search(r"^URL: (\S+)", text, flags=re.MULTILINE)
+            if match and self.is_confident_website(match.group(1)):
+                website = f"https://{canonical_domain(match.group(1))}"
+                for source in ("trustpilot", "similarweb"):
+                    self._start(source, website)
+
+    def _key(self, source: str, target: str) -> Tuple[str, str]:
+        canonical = canonical_linkedin_url(target) if source == "linkedin" else canonical_domain(target)
+        return source, canonical
+
+    def _start(self, source: str, target: str) -> None:
+        key = self._key(source, target)
+        if source not in self.launchers or key in self.tasks:
+            return
+        # Only one speculative run per source; a second candidate is less likely to be right
+        if any(existing_source == source for existing_source, _ in self.tasks):
+            return
+        Actor.log.info(f"Speculatively starting {source} enrichment for {target}")
+        self.tasks[key] = asyncio.create_task(self.launchers[source](target))
+
+    def take(self, source: str, target: str) -> Optional[asyncio.Task]:
+        """Claim the speculative task for the final target, if one was started for it."""
+        task = self.tasks.pop(self._key(source, target), None)
+        if task is not None:
+            self.claimed += 1
+            Actor.log.info(f"Reusing speculative {source} enrichment for {target}")
+        return task
+
+    def retain(self, targets: Dict[str, str]) -> None:
+        """Cancel speculative tasks that do not match the final target of their source."""
+        expected = {self._key(source, target) for source, target in targets.items() if target}
+        for key in [key for key in self.tasks if key not in expected]:
+            Actor.log.info(f"Cancelling speculative {key[0]} enrichment for {key[1]}")
+            self.tasks.pop(key).cancel()
+
+    def cancel_unclaimed(self) -> None:
+        """Cancel speculative tasks whose target did not match the final research result."""
+        for (source, target), task in self.tasks.items():
+            if not task.done():
+                Actor.log.info(f"Cancelling speculative {source} enrichment for {target}")
+            task.cancel()
+        self.tasks.clear()
@@ -0,0 +1,294 @@
+"""Standby mode: a long-lived HTTP server that researches companies on request.
+
+The agents, the Apify client and the caches are created once and stay warm across requests, so a
+request only pays for the research itself. Requests beyond `standby_max_requests` wait in an
+admission queue of up to `standby_max_queue` requests; the server answers 503 when that is full.
+
+    GET  /                                  readiness and load of the server
+    GET  /research?company_name=Apify       research and answer with JSON
+    POST /research  {"companies": [...]}    the body takes the same fields as the Actor input
+    ...&stream=true or Accept: text/event-stream streams "report", "result" and "done" events
+
+Every request gets a `request_id`, and its reports and traces are saved under
+`report_<request_id>_<company>_<hash>.md` and `trace_<request_id>_<company>_<hash>.json`.
+
+Run locally with: python -m src.standby --port 8080
+"""
+from apify import Actor
+from apify_client import ApifyClientAsync
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlsplit
+import argparse
+import asyncio
+import contextlib
+import json
+import time
+import uuid
+from .main import SharedResources, get_client, get_company_names, load_shared_resources, research_companies, save_shared_resources
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1024 * 1024
+
+# Records of each cache kept in memory between requests
+STANDBY_MEMORY_ENTRIES = 1000
+
+# Input fields that configure the shared caches, fixed when the server starts
+SERVER_INPUT_KEYS = {
+    "use_cache", "cache_store_name", "cache_dir", "cache_ttl_days", "memory_strategy",
+    "cache_completions", "completion_cache_size", "standby_max_requests", "standby_max_queue",
+    "standby_max_companies", "billing_flush_secs", "billing_flush_events",
+}
+
+# Bounds of the per-request fields that size the work of a request, as in the input schema
+REQUEST_LIMITS = {
+    "max_concurrency": (1, 20),
+    "competitor_count": (0, 10),
+    "max_batch_size": (1, 100),
+}
+
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+    """Parse one HTTP/1.1 request, or return None when the client closed the connection."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"The request body is limited to {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return HttpRequest(method.upper(), url.path.rstrip("/") or "/", dict(parse_qsl(url.query)), headers, body)
+
+def parse_query_value(value: str) -> Any:
+    """Query values are JSON when they parse, e.g. max_concurrency=3 or stream_report=true, and strings otherwise."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def write_head(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]) -> None:
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", *(f"{name}: {value}" for name, value in headers.items()), "Connection: close"]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    write_head(writer, status, {"Content-Type": "application/json", "Content-Length": str(len(body)), **(headers or {})})
+    writer.write(body)
+    await writer.drain()
+
+class StandbyServer:
+    """HTTP front end of the research pipeline that keeps its caches warm between requests."""
+
+    def __init__(self, actor_input: Dict[str, Any], client: ApifyClientAsync):
+        self.actor_input = actor_input
+        self.client = client
+        self.max_requests = max(1, actor_input.get("standby_max_requests", 2))
+        self.max_queue = max(0, actor_input.get("standby_max_queue", 10))
+        self.max_companies = max(1, actor_input.get("standby_max_companies", 10))
+        self.shared: Optional[SharedResources] = None
+        self.active = 0
+        self.queued = 0
+        self.served = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(self.max_requests)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "served": self.served,
+            "rejected": self.rejected,
+            "max_requests": self.max_requests,
+            "max_queue": self.max_queue,
+        }
+
+    async def start(self, host: str = "0.0.0.0", port: int = 0) -> int:
+        """Load the caches once and start listening. Returns the bound port."""
+        self.shared = await load_shared_resources(self.actor_input, memory_entries=STANDBY_MEMORY_ENTRIES)
+        self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        """Stop listening and persist the caches for the next run."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.shared:
+            await save_shared_resources(self.shared)
+            if self.shared.ledger:
+                await self.shared.ledger.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await read_request(reader)
+            if request:
+                await self.route(request, writer)
+        except HttpError as e:
+            headers = {"Retry-After": "5"} if e.status == 503 else None
+            await send_json(writer, e.status, {"error": e.message}, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            Actor.log.exception(f"Standby request failed: {str(e)}")
+            with contextlib.suppress(Exception):
+                await send_json(writer, 500, {"error": str(e)})
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def route(self, request: HttpRequest, writer: asyncio.StreamWriter) -> None:
+        if request.path == "/" and request.method == "GET" and not request.query:
+            # Also answers the platform's readiness probe
+            await send_json(writer, 200, {"status": "ready", **self.stats})
+            return
+        if request.path not in ("/", "/research") or request.method not in ("GET", "POST"):
+            raise HttpError(404, "Use GET / for the server status, or GET or POST /research to research companies")
+
+        request_input = {
+            key: value if key in ("company_name", "companies") else parse_query_value(value)
+            for key, value in request.query.items()
+        }
+        if isinstance(request_input.get("companies"), str):
+            request_input["companies"] = [name for name in request_input["companies"].split(",") if name.strip()]
+        if request.body:
+            try:
+                body = json.loads(request.body)
+            except ValueError:
+                raise HttpError(400, "The request body must be a JSON object")
+            if not isinstance(body, dict):
+                raise HttpError(400, "The request body must be a JSON object")
+            request_input.update(body)
+
+        stream = bool(request_input.pop("stream", False)) or "text/event-stream" in request.headers.get("accept", "")
+        await self.research(request_input, stream, writer)
+
+    async def research(self, request_input: Dict[str, Any], stream: bool, writer: asyncio.StreamWriter) -> None:
+        company_names = get_company_names(request_input)
+        if not company_names:
+            raise HttpError(400, "Provide `company_name` or `companies`")
+        # One request must not take more than its share of the server, whatever admission allowed
+        if len(company_names) > self.max_companies:
+            raise HttpError(400, f"A request can research at most {self.max_companies} companies")
+        for key, (minimum, maximum) in REQUEST_LIMITS.items():
+            value = request_input.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int) or not minimum <= value <= maximum):
+                raise HttpError(400, f"`{key}` must be an integer from {minimum} to {maximum}")
+        # Per-request fields override the server input, except the ones that configure the shared caches
+        actor_input = {key: value for key, value in self.actor_input.items() if key not in ("company_name", "companies")}
+        actor_input.update({key: value for key, value in request_input.items() if key not in SERVER_INPUT_KEYS})
+        if stream:
+            actor_input["stream_report"] = True
+
+        if self._slots.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HttpError(503, f"{self.active} requests are running and {self.queued} are queued, retry later")
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        # Concurrent requests for the same company must not overwrite each other's report
+        request_id = uuid.uuid4().hex[:12]
+        try:
+            self.shared.ledger.add('init', 1)
+            if stream:
+                await self.stream_research(company_names, actor_input, writer, request_id)
+            else:
+                start = time.perf_counter()
+                results = await research_companies(company_names, actor_input, self.client, self.shared, request_id=request_id)
+                await send_json(writer, 200, {
+                    "companies": [company_info.model_dump(mode="json") for company_info in results],
+                    "wall_time": round(time.perf_counter() - start, 3),
+                    "request_id": request_id,
+                })
+            self.served += 1
+        finally:
+            self.active -= 1
+            self._slots.release()
+            await save_shared_resources(self.shared)
+
+    async def stream_research(self, company_names: List[str], actor_input: Dict[str, Any], writer: asyncio.StreamWriter, request_id: str) -> None:
+        """Answer with server-sent events: partial "report" markdown, every "result" and a final "done"."""
+        write_head(writer, 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        connected = True
+
+        async def send_event(event: str, data: Dict[str, Any]) -> None:
+            nonlocal connected
+            if not connected:
+                return
+            try:
+                writer.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                await writer.drain()
+            except ConnectionError:
+                # The research goes on and its results are still saved to the dataset
+                connected = False
+
+        start = time.perf_counter()
+        try:
+            results = await research_companies(company_names, actor_input, self.client, self.shared, on_event=send_event, request_id=request_id)
+        except Exception as e:
+            Actor.log.exception(f"Standby research failed: {str(e)}")
+            await send_event("error", {"error": str(e)})
+            return
+        await send_event("done", {"companies": len(results), "wall_time": round(time.perf_counter() - start, 3), "request_id": request_id})
+
+async def serve(actor_input: Dict[str, Any], client: ApifyClientAsync, host: str = "0.0.0.0", port: Optional[int] = None) -> None:
+    """Serve research requests until the run is stopped."""
+    server = StandbyServer(actor_input, client)
+    port = await server.start(host, Actor.config.web_server_port if port is None else port)
+    Actor.log.info(f"Standby server listening on port {port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+async def run_local(host: str, port: int) -> None:
+    async with Actor:
+        await serve(await Actor.get_input() or {}, get_client(), host, port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve research requests over HTTP with warm agents and caches.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    asyncio.run(run_local(args.host, args.port))
@@ -1,59 +1,227 @@
 from apify import Actor
-from typing import List
-from pydantic_ai import RunContext
-from .models import Deps, LinkedInData, TrustpilotReview, SimilarwebData, GoogleMapsPlace, AdsSource, TopReferral, SocialNetwork, TopCountry, Competitor, TrafficSourcesData, AgeDistributionData, TopKeyword, GoogleMapsReview, AgeGroup
+from typing import Any, AsyncIterator, Dict, List, Optional
+from .billing import charge
+from .cache import cached
+from .tracing import span, traced
+from .pruning import FIELD_KEYWORDS, prune_page
+from .mapping import LINKEDIN_MAPPING, TRUSTPILOT_MAPPING, GOOGLE_MAPS_MAPPING, SIMILARWEB_MAPPING
+from .batching import FINISHED_RUN_STATUSES, abort_run
+from .models import Deps, LinkedInData, NewsItem, TrustpilotReview, SimilarwebData, GoogleMapsPlace
+import asyncio
+import math
 import re
 from urllib.parse import urlparse
 
-async def search_google(ctx: RunContext[Deps], query: str, max_results: int = 1) -> List[str]:
-    """Search Google for the given query and return the results as a list of strings.
+# Items fetched per dataset request, small enough to keep memory flat on large datasets
+DATASET_PAGE_SIZE = 100
+
+# Default time budget per source in seconds; a run still going after it is aborted and its partial dataset is used
+DEFAULT_SOURCE_TIMEOUT_SECS = {
+    "search": 120,
+    "linkedin": 180,
+    "similarweb": 240,
+    "trustpilot": 240,
+    "google_maps": 300,
+}
+
+async def run_scraper_for_target(
+    deps: Deps,
+    source: str,
+    actor_id: str,
+    target: str,
+    input_key: str,
+    base_input: Dict[str, Any],
+    memory_mbytes: int,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Run a multi-target scraper for a single target and return up to `limit` of its dataset items.
+
+    When batching is enabled, the target is coalesced with other in-flight targets of the same source
+    into one actor run and only the items belonging to this target are returned. A target that none
+    of the batch items could be routed to falls back to a run of its own.
+    """
+    if deps.batcher:
+        budget = deps.time_budget(source)
+        if budget is not None and budget < 1:
+            deps.timed_out_sources.add(source)
+            raise TimeoutError(f"No time left to run {actor_id}")
+        with span("batch.wait", actor=actor_id):
+            items = await deps.batcher.submit(source, target, actor_id, input_key, base_input, memory_mbytes, deps)
+        if items is not None:
+            return items[:limit] if limit is not None else items
+
+    return await call_actor(deps, actor_id, {**base_input, input_key: [target]}, memory_mbytes, limit, source)
+
+async def call_actor(
+    deps: Deps,
+    actor_id: str,
+    run_input: Dict[str, Any],
+    memory_mbytes: int,
+    limit: Optional[int] = None,
+    source: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Start an actor, wait for it to finish and return up to `limit` of its dataset items."""
+    return [item async for page in iterate_actor_pages(deps, actor_id, run_input, memory_mbytes, limit, source) for item in page]
+
+async def iterate_actor_pages(
+    deps: Deps,
+    actor_id: str,
+    run_input: Dict[str, Any],
+    memory_mbytes: int,
+    limit: Optional[int] = None,
+    source: Optional[str] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Start an actor, wait for it to finish and stream its dataset items page by page, tracing each step.
+
+    With a time budget for `source`, the run gets it as its platform timeout and is aborted if it is
+    still running afterwards. The items it pushed until then are still returned, and the source is
+    recorded in `deps.timed_out_sources`. With `deps.profiles`, `memory_mbytes` is only the default
+    and the memory is picked from the stats of earlier runs.
+    """
+    budget = deps.time_budget(source) if source else None
+    if budget is not None and budget < 1:
+        deps.timed_out_sources.add(source)
+        raise TimeoutError(f"No time left to run {actor_id}")
+    timeout_secs = math.ceil(budget) if budget is not None else None
+    if deps.profiles:
+        memory_mbytes = deps.profiles.choose(actor_id, run_input, memory_mbytes)
     
-    Args:
-        ctx: The run context containing dependencies
-        query: The query to search for
-        max_results: The maximum number of results to return
+    with span("actor.start", actor=actor_id, memory_mbytes=memory_mbytes):
+        run = await deps.client.actor(actor_id).start(run_input=run_input, memory_mbytes=memory_mbytes, timeout_secs=timeout_secs)
+    
+    try:
+        with span("actor.wait", actor=actor_id) as attrs:
+            finished = await deps.client.run(run["id"]).wait_for_finish(wait_secs=timeout_secs)
+            # Platform-side run duration, the rest of the wait is queueing and polling
+            attrs["run_duration"] = ((finished or {}).get("stats") or {}).get("runTimeSecs")
+    except asyncio.CancelledError:
+        # The stage gave up on this source, stop the run instead of letting it finish unobserved
+        await asyncio.shield(abort_run(deps.client, run["id"], actor_id))
+        raise
+    
+    if deps.profiles:
+        deps.profiles.record(actor_id, run_input, memory_mbytes, finished)
+    status = (finished or {}).get("status")
+    if status not in FINISHED_RUN_STATUSES:
+        await abort_run(deps.client, run["id"], actor_id)
+    if status not in FINISHED_RUN_STATUSES or status == "TIMED-OUT":
+        Actor.log.warning(f"{actor_id} ran out of time, using its partial results")
+        if source:
+            deps.timed_out_sources.add(source)
+    
+    async for page in iterate_dataset_pages(deps, run["defaultDatasetId"], limit):
+        yield page
+
+async def iterate_dataset(
+    deps: Deps,
+    dataset_id: str,
+    limit: Optional[int] = None,
+    page_size: int = DATASET_PAGE_SIZE,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield dataset items one at a time, fetching them a page at a time."""
+    async for page in iterate_dataset_pages(deps, dataset_id, limit, page_size):
+        for item in page:
+            yield item
+
+async def iterate_dataset_pages(
+    deps: Deps,
+    dataset_id: str,
+    limit: Optional[int] = None,
+    page_size: int = DATASET_PAGE_SIZE,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yield pages of dataset items until `limit` items were read or the dataset ends.
+
+    Callers that stop iterating early skip the remaining pages entirely.
+    """
+    offset = 0
+    while limit is None or offset < limit:
+        page_limit = page_size if limit is None else min(page_size, limit - offset)
+        # The span is closed before yielding so it never stays open across the caller's work
+        with span("dataset.list_items", offset=offset) as attrs:
+            page = await deps.client.dataset(dataset_id).list_items(offset=offset, limit=page_limit)
+            items = page.items[:page_limit]
+            attrs["items"] = len(items)
         
-    Returns:
-        A list of strings containing the search results
+        if items:
+            yield items
+        offset += len(items)
+        
+        if len(items) < page_limit:
+            return
+
+async def search_once(deps: Deps, query: str, max_results: int) -> List[str]:
+    """Run a search through the search memo, let the speculator see its results and prune them for the current company.
+
+    The memo keeps whole result pages, so every hit is pruned against the fields the current company still misses.
     """
+    if deps.search_memo:
+        raw_results = await deps.search_memo.get_or_run(
+            query, max_results, lambda: run_google_search(deps, query, max_results), deps.cache_max_age_days.get("search")
+        )
+    else:
+        raw_results = await run_google_search(deps, query, max_results)
+    
+    # Let enrichment scrapers start early from the URLs found so far
+    if deps.speculator:
+        deps.speculator.observe(raw_results)
+    
+    results = [prune_search_result(deps, query, result) for result in raw_results]
+    if deps.search_char_budget and raw_results:
+        Actor.log.info(f"Kept {sum(len(r) for r in results)}/{sum(len(r) for r in raw_results)} characters of the results for: {query}")
+    return results
+
+def prune_search_result(deps: Deps, query: str, result: str) -> str:
+    """Keep only the chunks of a result page relevant to the query and the fields still missing."""
+    header, separator, content = result.partition("Content:\n")
+    if not separator or not deps.search_char_budget:
+        return result
+    missing_fields = FIELD_KEYWORDS.keys() - deps.covered_fields
+    content, covered = prune_page(content[:-1] if content.endswith("\n") else content, query, missing_fields, deps.search_char_budget)
+    deps.covered_fields.update(covered)
+    return f"{header}Content:\n{content}\n"
+
+@traced("tool.search_google")
+async def run_google_search(deps: Deps, query: str, max_results: int) -> List[str]:
+    """Run the RAG web browser for a query and format each whole result page as a string."""
     Actor.log.info(f"Searching Google for: {query} ({max_results} results)")
     run_input = {
         "query": query,
         "maxResults": max_results,
         "outputFormats": ["markdown"],
     }
-    run = ctx.deps.client.actor("apify/rag-web-browser").call(run_input=run_input, memory_mbytes=1024)
-    
-    # Get the raw items from ListPage and convert to list of strings
-    list_page = ctx.deps.client.dataset(run["defaultDatasetId"]).list_items()
-    results = []
+    try:
+        items = await call_actor(deps, "apify/rag-web-browser", run_input, memory_mbytes=1024, limit=max_results, source="search")
+    except Exception as e:
+        Actor.log.error(f"Error searching Google for {query}: {str(e)}")
+        return []
     
-    for item in list_page.items:
-        if not isinstance(item, dict):
-            continue
-            
-        # Create a formatted result with the most useful information
-        formatted_result = ""
-        
-        # Add title and URL if available
-        if "searchResult" in item and isinstance(item["searchResult"], dict):
-            if "title" in item["searchResult"]:
-                formatted_result += f"# {item['searchResult']['title']}\n\n"
-            if "url" in item["searchResult"]:
-                formatted_result += f"URL: {item['searchResult']['url']}\n\n"
-            if "description" in item["searchResult"]:
-                formatted_result += f"Description: {item['searchResult']['description']}\n\n"
-        
-        # Add the markdown content (most useful part) if available
-        if "markdown" in item and item["markdown"]:
-            markdown_content = item["markdown"]
-            
-            formatted_result += f"Content:\n{markdown_content}\n"
-        
-        if formatted_result:
-            results.append(formatted_result)
+    # Convert the raw items to a list of strings
+    raw_results = []
+    with span("parse.search", items=len(items)):
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+
+            # Create a formatted result with the most useful information
+            raw_result = ""
+
+            # Add title and URL if available
+            if "searchResult" in item and isinstance(item["searchResult"], dict):
+                if "title" in item["searchResult"]:
+                    raw_result += f"# {item['searchResult']['title']}\n\n"
+                if "url" in item["searchResult"]:
+                    raw_result += f"URL: {item['searchResult']['url']}\n\n"
+                if "description" in item["searchResult"]:
+                    raw_result += f"Description: {item['searchResult']['description']}\n\n"
+
+            # Add the markdown content (most useful part) if available, it is pruned per company after the memo
+            if "markdown" in item and item["markdown"]:
+                raw_result += f"Content:\n{item['markdown']}\n"
+
+            if raw_result:
+                raw_results.append(raw_result)
             
-    # Store search results in the default KV store
+    # Store the raw, unpruned search results in the default KV store
     try:
         # Sanitize the query to use as filename
         def sanitize_filename(text: str) -> str:
@@ -66,81 +234,95 @@ async def search_google(ctx: RunContext[Deps], query: str, max_results: int = 1)
         
         # Use the proper method to get the key-value store
         default_store = await Actor.open_key_value_store()
-        await default_store.set_value(kv_key, results)
+        with span("kv.set_value", key=kv_key):
+            await default_store.set_value(kv_key, raw_results)
     except Exception as e:
         Actor.log.warning(f"Failed to store search results: {str(e)}")
             
-    Actor.log.info(f"Found {len(results)}/{max_results} search results for: {query}")
-    await Actor.charge('tool-result', len(results))
-    return results 
+    Actor.log.info(f"Found {len(raw_results)}/{max_results} search results for: {query}")
+    await charge('tool-result', len(raw_results))
+    return raw_results 
+
+@traced("tool.news")
+async def search_company_news(deps: Deps, company_name: str, max_results: int = 5) -> List[NewsItem]:
+    """Get the latest news about a company straight from the search results, without the research agent.
 
+    Args:
+        deps: The dependencies carrying the async Apify client.
+        company_name: Name of the company to get news about
+        max_results: Maximum number of news items to return
+    
+    Returns:
+        A list of NewsItem objects with the title, description and URL of each result.
+    """
+    Actor.log.info(f"Searching news for: {company_name}")
+    run_input = {
+        "query": f"{company_name} news",
+        "maxResults": max_results,
+        "outputFormats": ["markdown"],
+    }
+    try:
+        items = await call_actor(deps, "apify/rag-web-browser", run_input, memory_mbytes=1024, limit=max_results, source="search")
+    except Exception as e:
+        Actor.log.error(f"Error searching news for {company_name}: {str(e)}")
+        return []
+    
+    news = []
+    with span("parse.news", items=len(items)):
+        for item in items:
+            result = item.get("searchResult") if isinstance(item, dict) else None
+            if isinstance(result, dict) and result.get("title") and result.get("url"):
+                news.append(NewsItem(title=result["title"], description=result.get("description") or "", url=result["url"]))
+    
+    Actor.log.info(f"Found {len(news)} news items for {company_name}")
+    await charge('tool-result', len(news))
+    return news
+
+@traced("tool.linkedin")
+@cached("linkedin", LinkedInData)
 async def get_linkedin_company_profile(
-    client,
+    deps: Deps,
     linkedin_company_url: str
 ) -> LinkedInData:
     """Get LinkedIn company profile.
 
     Args:
-        client: The Apify client for making API calls.
+        deps: The dependencies carrying the async Apify client.
         linkedin_company_url: The LinkedIn company URL. E.g. https://www.linkedin.com/company/apple/
 
     Returns:
         A LinkedInData object containing company details from LinkedIn.
     """
     Actor.log.info(f"Getting LinkedIn company profile for: {linkedin_company_url}")
-    run_input = {
-        "linkedinUrls": [linkedin_company_url]
-    }
-
     try:
-        run = client.actor("icypeas_official/linkedin-company-scraper").call(run_input=run_input, memory_mbytes=128)
-        dataset = client.dataset(run["defaultDatasetId"]).list_items()
+        items = await run_scraper_for_target(
+            deps, "linkedin", "icypeas_official/linkedin-company-scraper", linkedin_company_url,
+            input_key="linkedinUrls", base_input={}, memory_mbytes=128, limit=1,
+        )
 
-        if dataset.items and len(dataset.items) > 0:
+        if items and len(items) > 0:
             Actor.log.info(f"LinkedIn company profile retrieved for {linkedin_company_url}")
-            item = dataset.items[0]['data'][0]['result']
-            
-            # Format address if it's a dictionary
-            address = item.get("address")
-            if isinstance(address, dict):
-                address_parts = []
-                if address.get("streetAddress"):
-                    address_parts.append(address.get("streetAddress"))
-                if address.get("addressLocality"):
-                    address_parts.append(address.get("addressLocality"))
-                if address.get("addressRegion"):
-                    address_parts.append(address.get("addressRegion"))
-                if address.get("postalCode"):
-                    address_parts.append(address.get("postalCode"))
-                if address.get("addressCountry"):
-                    address_parts.append(address.get("addressCountry"))
-                address = ", ".join([part for part in address_parts if part])
-            
-            # Create and return a LinkedInData model instance
-            return LinkedInData(
-                name=item.get("name"),
-                description=item.get("description"),
-                industry=item.get("industry"),
-                employees=item.get("numberOfEmployees"),
-                website=item.get("website"),
-                specialties=[s["value"] for s in item.get("specialties", [])],
-                address=address
-            )
-        await Actor.charge('tool-result', 1)
+            with span("parse.linkedin"):
+                profile = LINKEDIN_MAPPING.validate_one(items[0]['data'][0]['result'])
+            await charge('tool-result', 1)
+            return profile
+        Actor.log.warning(f"No LinkedIn company profile retrieved for {linkedin_company_url}")
         return LinkedInData()
 
     except Exception as e:
         Actor.log.error(f"Error fetching LinkedIn company profile: {str(e)}")
         return LinkedInData() 
     
+@traced("tool.google_maps")
+@cached("google_maps", List[GoogleMapsPlace])
 async def search_google_maps(
-    client,
+    deps: Deps,
     query: str, 
 ) -> List[GoogleMapsPlace]:
     """Get Google Maps search results focused on company information.
 
     Args:
-        client: The Apify client for making API calls.
+        deps: The dependencies carrying the async Apify client.
         query: The search query for finding a company/business on Google Maps.
               Examples:
               - Company name: "Apify"
@@ -153,68 +335,40 @@ async def search_google_maps(
     Actor.log.info(
         f"Searching Google Maps for: {query}")
     run_input = {
-        "searchStringsArray": [query],
         "maxCrawledPlaces": 1,
         "maxReviews": 100,
         "language": "en",
     }
 
     try:
-        run = client.actor("compass/crawler-google-places").call(run_input=run_input, memory_mbytes=1024)
-        dataset = client.dataset(run["defaultDatasetId"]).list_items()
+        items = await run_scraper_for_target(
+            deps, "google_maps", "compass/crawler-google-places", query,
+            input_key="searchStringsArray", base_input=run_input, memory_mbytes=1024,
+            limit=run_input["maxCrawledPlaces"],
+        )
 
-        results = []
-        for item in dataset.items:
+        with span("parse.google_maps", items=len(items)):
+            results = GOOGLE_MAPS_MAPPING.validate_many(items)
+        if results:
             Actor.log.info(f"Google Maps data retrieved for {query}")
-            
-            # Extract reviews with text
-            reviews = []
-            if "reviews" in item and isinstance(item["reviews"], list):
-                for review in item["reviews"]:
-                    # Only include reviews that have text
-                    if review.get("text"):
-                        reviews.append(GoogleMapsReview(
-                            reviewerUrl=review.get("reviewerUrl"),
-                            name=review.get("name"),
-                            text=review.get("text"),
-                            publishedAtDate=review.get("publishedAtDate"),
-                            stars=review.get("stars")
-                        ))
-            
-            # Create a GoogleMapsPlace model instance
-            place = GoogleMapsPlace(
-                title=item.get("title", ""),
-                description=item.get("description", ""),
-                categoryName=item.get("categoryName", ""),
-                categories=item.get("categories", []),
-                address=item.get("address", ""),
-                street=item.get("street", ""),
-                city=item.get("city", ""),
-                postalCode=item.get("postalCode", ""),
-                countryCode=item.get("countryCode", ""),
-                website=item.get("website", ""),
-                phone=item.get("phone", ""),
-                totalScore=item.get("totalScore", 0),
-                reviewsCount=item.get("reviewsCount", 0),
-                reviews=reviews
-            )
-            results.append(place)
-
-        await Actor.charge('tool-result', len(results))
+
+        await charge('tool-result', len(results))
         return results
 
     except Exception as e:
         Actor.log.error(f"Error fetching Google Maps results: {str(e)}")
         return [] 
     
+@traced("tool.trustpilot")
+@cached("trustpilot", List[TrustpilotReview])
 async def get_trustpilot_reviews(
-    client,
+    deps: Deps,
     company_domain: str,
 ) -> List[TrustpilotReview]:
     """Get reviews from Trustpilot for a website.
 
     Args:
-        client: The Apify client for making API calls.
+        deps: The dependencies carrying the async Apify client.
         company_domain: Domain name of the company (e.g., "apify.com")
 
     Returns:
@@ -237,30 +391,18 @@ async def get_trustpilot_reviews(
     }
     
     try:
-        run = client.actor("nikita-sviridenko/trustpilot-reviews-scraper").call(run_input=run_input, memory_mbytes=1024)
-        dataset = client.dataset(run["defaultDatasetId"]).list_items()
+        # Validate reviews a page at a time instead of holding the raw dataset in memory
+        reviews = []
+        async for page in iterate_actor_pages(
+            deps, "nikita-sviridenko/trustpilot-reviews-scraper", run_input, memory_mbytes=1024, limit=run_input["count"],
+            source="trustpilot",
+        ):
+            with span("parse.trustpilot", items=len(page)):
+                reviews.extend(TRUSTPILOT_MAPPING.validate_many(page))
         
-        if dataset.items:
-            Actor.log.info(f"{len(dataset.items)} Trustpilot reviews retrieved for {domain}")
-            reviews = []
-            for item in dataset.items:
-                # Create a TrustpilotReview model instance
-                review = TrustpilotReview(
-                    reviewUrl=item.get("reviewUrl", ""),
-                    authorName=item.get("authorName", ""),
-                    datePublished=item.get("datePublished", ""),
-                    reviewHeadline=item.get("reviewHeadline", ""),
-                    reviewBody=item.get("reviewBody", ""),
-                    reviewLanguage=item.get("reviewLanguage", ""),
-                    ratingValue=item.get("ratingValue", 0),
-                    verificationLevel=item.get("verificationLevel", ""),
-                    numberOfReviews=item.get("numberOfReviews", 0),
-                    consumerCountryCode=item.get("consumerCountryCode", ""),
-                    experienceDate=item.get("experienceDate", ""),
-                    likes=item.get("likes", 0)
-                )
-                reviews.append(review)
-            await Actor.charge('tool-result', len(reviews))
+        if reviews:
+            Actor.log.info(f"{len(reviews)} Trustpilot reviews retrieved for {domain}")
+            await charge('tool-result', len(reviews))
             return reviews
         else:
             Actor.log.warning(f"No Trustpilot reviews retrieved for {domain}")
@@ -270,14 +412,16 @@ async def get_trustpilot_reviews(
         Actor.log.error(f"Error fetching Trustpilot reviews for {domain}: {str(e)}")
         return [] 
     
+@traced("tool.similarweb")
+@cached("similarweb", SimilarwebData)
 async def get_similarweb_results(
-    client,
+    deps: Deps,
     website: str
 ) -> SimilarwebData:
     """Get analytics and company information from Similarweb for a website.
 
     Args:
-        client: The Apify client for making API calls.
+        deps: The dependencies carrying the async Apify client.
         website: Website domain to analyze (e.g., "google.com")
     
     Returns:
@@ -285,193 +429,18 @@ async def get_similarweb_results(
     """
     Actor.log.info(f"Getting Similarweb results for website: {website}")
     
-    run_input = {
-        "websites": [website]
-    }
-    
     try:
-        run = client.actor("tri_angle/similarweb-scraper").call(run_input=run_input, memory_mbytes=1024)
-        dataset = client.dataset(run["defaultDatasetId"]).list_items()
+        items = await run_scraper_for_target(
+            deps, "similarweb", "tri_angle/similarweb-scraper", website,
+            input_key="websites", base_input={}, memory_mbytes=1024, limit=1,
+        )
         
-        if dataset.items and len(dataset.items) > 0:
+        if items and len(items) > 0:
             Actor.log.info(f"Similarweb data retrieved for {website}")
-            data = dataset.items[0]
-            
-            # Create address string
-            address = f"{data.get('companyHeadquarterCity', '')}, {data.get('companyHeadquarterStateCode', '')}, {data.get('companyHeadquarterCountryCode', '')}"
-            
-            # Process ad sources
-            ad_sources = []
-            for a in data.get("adsSources", []):
-                if isinstance(a, dict) and a.get("domain"):
-                    ad_sources.append(AdsSource(
-                        domain=str(a.get("domain", "")),
-                        visitsShare=float(a.get("visitsShare", 0))
-                    ))
-            
-            # Process top referrals
-            top_referrals = []
-            for r in data.get("topReferrals", []):
-                if isinstance(r, dict) and r.get("domain"):
-                    top_referrals.append(TopReferral(
-                        domain=str(r.get("domain", "")),
-                        visitsShare=float(r.get("visitsShare", 0))
-                    ))
-            
-            # Process social network distribution
-            social_distribution = []
-            for c in data.get("socialNetworkDistribution", []):
-                if isinstance(c, dict):
-                    social_distribution.append(SocialNetwork(
-                        name=str(c.get("name", "")),
-                        visitsShare=float(c.get("visitsShare", 0))
-                    ))
-            
-            # Process top countries
-            top_countries = []
-            for c in data.get("topCountries", []):
-                if isinstance(c, dict):
-                    top_countries.append(TopCountry(
-                        country=str(c.get("countryAlpha2Code", "")),
-                        share=float(c.get("visitsShare", 0))
-                    ))
-            
-            # Process competitors
-            competitors = []
-            for c in data.get("topSimilarityCompetitors", []):
-                if isinstance(c, dict) and c.get("domain"):
-                    competitors.append(Competitor(
-                        domain=str(c.get("domain", "")),
-                        visitsTotalCount=int(c.get("visitsTotalCount", 0))
-                    ))
-            
-            # Process traffic sources from trafficSources object
-            traffic_sources = TrafficSourcesData()
-            traffic_sources_dict = data.get("trafficSources", {})
-            if isinstance(traffic_sources_dict, dict):
-                traffic_sources = TrafficSourcesData(
-                    direct=traffic_sources_dict.get("directVisitsShare"),
-                    referrals=traffic_sources_dict.get("referralVisitsShare"),
-                    search=traffic_sources_dict.get("organicSearchVisitsShare"),
-                    social=traffic_sources_dict.get("socialNetworksVisitsShare"),
-                    mail=traffic_sources_dict.get("mailVisitsShare"),
-                    paid=traffic_sources_dict.get("paidSearchVisitsShare")
-                )
-            
-            # Process age distribution
-            age_dist_groups = []
-            age_distribution = AgeDistributionData()
-            
-            # Handle age distribution as an array of groups
-            age_dist_array = data.get("ageDistribution", [])
-            if isinstance(age_dist_array, list):
-                for group in age_dist_array:
-                    if isinstance(group, dict):
-                        age_dist_groups.append(AgeGroup(
-                            minAge=group.get("minAge"),
-                            maxAge=group.get("maxAge"),
-                            value=group.get("value")
-                        ))
-                        
-                        # Also map to the original fields for backward compatibility
-                        min_age = group.get("minAge")
-                        max_age = group.get("maxAge")
-                        if min_age == 18 and max_age == 24:
-                            age_distribution.age18_24 = group.get("value")
-                        elif min_age == 25 and max_age == 34:
-                            age_distribution.age25_34 = group.get("value")
-                        elif min_age == 35 and max_age == 44:
-                            age_distribution.age35_44 = group.get("value")
-                        elif min_age == 45 and max_age == 54:
-                            age_distribution.age45_54 = group.get("value")
-                        elif min_age == 55 and max_age == 64:
-                            age_distribution.age55_64 = group.get("value")
-                        elif min_age == 65:
-                            age_distribution.age65_plus = group.get("value")
-                
-                # Add the groups to the age distribution
-                age_distribution.groups = age_dist_groups
-            
-            # Process top keywords
-            top_keywords = []
-            keywords_data = data.get("topKeywords", [])
-            if isinstance(keywords_data, list):
-                for kw in keywords_data:
-                    if isinstance(kw, dict) and kw.get("name"):
-                        top_keywords.append(TopKeyword(
-                            name=str(kw.get("name", "")),
-                            estimatedSearches=int(kw.get("volume", 0)),
-                            cpc=float(kw.get("cpc", 0.0))
-                        ))
-            
-            # Handle avgVisitDuration - keep it as a string
-            avg_visit_duration = data.get("avgVisitDuration")
-            # If it's an integer in seconds, convert to time format
-            if isinstance(avg_visit_duration, int):
-                mins = avg_visit_duration // 60
-                secs = avg_visit_duration % 60
-                avg_visit_duration = f"00:{mins:02d}:{secs:02d}"
-            
-            # Keep traffic values as floats
-            organic_traffic = data.get("organicTraffic")
-            if not isinstance(organic_traffic, float):
-                try:
-                    organic_traffic = float(organic_traffic or 0)
-                except (ValueError, TypeError):
-                    organic_traffic = 0.0
-                    
-            paid_traffic = data.get("paidTraffic")
-            if not isinstance(paid_traffic, float):
-                try:
-                    paid_traffic = float(paid_traffic or 0)
-                except (ValueError, TypeError):
-                    paid_traffic = 0.0
-            
-            # Process top interested websites (only domain properties)
-            interested_websites = []
-            top_interested = data.get("topInterestedWebsites", [])
-            if isinstance(top_interested, list):
-                for w in top_interested:
-                    if isinstance(w, dict) and w.get("domain"):
-                        interested_websites.append(str(w.get("domain", "")))
-                    elif isinstance(w, str):
-                        interested_websites.append(w)
-            
-            await Actor.charge('tool-result', 1)
-            
-            # Create and return a SimilarwebData model instance
-            return SimilarwebData(
-                name=data.get("name", ""),
-                description=data.get("description", ""),
-                globalRank=data.get("globalRank", 0),
-                categoryId=data.get("categoryId", ""),
-                companyYearFounded=data.get("companyYearFounded", 0),
-                companyName=data.get("companyName", ""), 
-                companyEmployeesMin=data.get("companyEmployeesMin", 0),
-                companyEmployeesMax=data.get("companyEmployeesMax", 0),
-                companyAnnualRevenueMin=data.get("companyAnnualRevenueMin", 0),
-                companyHeadquarterCountryCode=data.get("companyHeadquarterCountryCode", ""),
-                companyHeadquarterStateCode=data.get("companyHeadquarterStateCode", ""),
-                companyHeadquarterCity=data.get("companyHeadquarterCity", ""),
-                avgVisitDuration=avg_visit_duration,
-                pagesPerVisit=data.get("pagesPerVisit", 0),
-                bounceRate=data.get("bounceRate", 0),
-                totalVisits=data.get("totalVisits", 0),
-                trafficSources=traffic_sources,
-                adsSources=ad_sources,
-                topKeywords=top_keywords,
-                organicTraffic=organic_traffic,
-                paidTraffic=paid_traffic,
-                topReferrals=top_referrals,
-                socialNetworkDistribution=social_distribution,
-                topCountries=top_countries,
-                topSimilarityCompetitors=competitors,
-                topInterestedWebsites=interested_websites,
-                ageDistribution=age_distribution,
-                maleDistribution=data.get("maleDistribution", 0),
-                femaleDistribution=data.get("femaleDistribution", 0),
-                address=address
-            )
+            with span("parse.similarweb"):
+                data = SIMILARWEB_MAPPING.validate_one(items[0])
+            await charge('tool-result', 1)
+            return data
         else:
             Actor.log.warning(f"No Similarweb data retrieved for {website}")
             return SimilarwebData()
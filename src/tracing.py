@@ -0,0 +1,102 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import functools
+import itertools
+import time
+
+@dataclass
+class Span:
+    id: int
+    name: str
+    parent: Optional[int]
+    start: float
+    end: Optional[float] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+class Tracer:
+    """Collects timed spans of one company's research run."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self.stage_timings: Dict[str, Dict[str, float]] = {}
+        self.critical_path: List[str] = []
+        self._ids = itertools.count(1)
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block. The yielded dict can be filled with attributes such as token counts."""
+        span = Span(next(self._ids), name, _current_span.get(), time.perf_counter(), attrs=dict(attrs))
+        self.spans.append(span)
+        token = _current_span.set(span.id)
+        try:
+            yield span.attrs
+        except BaseException as e:
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+
+    def record_stages(self, stage_timings: Dict[str, Dict[str, float]], critical_path: List[str]) -> None:
+        """Attach the pipeline stage timings and critical path to the trace."""
+        self.stage_timings = stage_timings
+        self.critical_path = critical_path
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the spans with a summary of the critical path and the slowest operations."""
+        child_time: Dict[int, float] = {}
+        for span in self.spans:
+            if span.parent is not None:
+                child_time[span.parent] = child_time.get(span.parent, 0.0) + span.duration
+
+        spans = [
+            {
+                "id": span.id,
+                "parent": span.parent,
+                "name": span.name,
+                "start": round(span.start - self.origin, 3),
+                "duration": round(span.duration, 3),
+                # Time spent in the span itself, e.g. model construction inside a tool span
+                "self_time": round(max(0.0, span.duration - child_time.get(span.id, 0.0)), 3),
+                **({"attrs": span.attrs} if span.attrs else {}),
+            }
+            for span in self.spans
+        ]
+        return {
+            "total_duration": round(time.perf_counter() - self.origin, 3),
+            "critical_path": [{"stage": name, **self.stage_timings.get(name, {})} for name in self.critical_path],
+            "stage_durations": {name: timing.get("duration") for name, timing in self.stage_timings.items()},
+            "slowest_spans": sorted(spans, key=lambda s: s["self_time"], reverse=True)[:10],
+            "spans": spans,
+        }
+
+# The tracer of the company being researched, inherited by every task started within it
+current_tracer: ContextVar[Optional[Tracer]] = ContextVar("current_tracer", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """Record a span on the current tracer, or do nothing when tracing is off."""
+    tracer = current_tracer.get()
+    if tracer is None:
+        yield dict(attrs)
+        return
+    with tracer.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+def traced(name: str) -> Callable:
+    """Wrap an async function in a span."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator